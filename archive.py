@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+أرشيف سجل الرسائل: مقاطع يومية مضغوطة للإلحاق فقط + فهرس صغير.
+
+- كل يوم في ملف messages-YYYY-MM-DD.jsonl.gz (سطر JSON لكل رسالة).
+- الإلحاق يضيف عضو gzip جديداً لنهاية الملف، فلا يُعاد كتابة ما سبق.
+- index.json يحفظ لكل مقطع عدد الصفوف ومجال المعرفات، وآخر معرف مؤرشف؛
+  الصفوف ذات المعرف الأصغر منه تُتجاهل، فإعادة التشغيل بعد انقطاع لا تكرر شيئاً.
+"""
+
+import os
+import json
+import gzip
+from pathlib import Path
+
+INDEX_FILE = "index.json"
+FIELDS = ("id", "user_id", "username", "first_name", "message", "created_at")
+
+
+def load_index(archive_dir: Path) -> dict:
+    path = archive_dir / INDEX_FILE
+    return json.loads(path.read_text()) if path.exists() else {"last_id": 0, "segments": {}}
+
+def _save_index(archive_dir: Path, index: dict):
+    tmp = archive_dir / (INDEX_FILE + ".tmp")
+    tmp.write_text(json.dumps(index, indent=1))
+    os.replace(tmp, archive_dir / INDEX_FILE)
+
+def append(archive_dir: Path, rows: list) -> int:
+    """تلحق الصفوف (بترتيب المعرف) بمقاطعها اليومية. تعيد آخر معرف مؤرشف."""
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    index = load_index(archive_dir)
+    by_day = {}
+    for row in rows:
+        if row[0] > index["last_id"]:
+            by_day.setdefault((row[5] or "")[:10] or "unknown", []).append(row)
+    for day, day_rows in sorted(by_day.items()):
+        name = f"messages-{day}.jsonl.gz"
+        with gzip.open(archive_dir / name, "ab") as out:
+            for row in day_rows:
+                out.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False).encode("utf-8") + b"\n")
+            out.flush()
+            os.fsync(out.fileobj.fileno())
+        seg = index["segments"].setdefault(day, {"file": name, "rows": 0, "first_id": day_rows[0][0], "last_id": 0})
+        seg["rows"] += len(day_rows)
+        seg["first_id"] = min(seg["first_id"], day_rows[0][0])
+        seg["last_id"] = max(seg["last_id"], day_rows[-1][0])
+        seg["bytes"] = (archive_dir / name).stat().st_size
+        index["last_id"] = max(index["last_id"], day_rows[-1][0])
+    _save_index(archive_dir, index)
+    return index["last_id"]
+
+def fetch(archive_dir: Path, ids) -> dict:
+    """تجلب رسائل مؤرشفة بمعرفاتها، بقراءة المقاطع التي يغطي مجالها المعرفات فقط."""
+    wanted = set(ids)
+    found = {}
+    if not wanted: return found
+    for seg in load_index(archive_dir)["segments"].values():
+        if not any(seg["first_id"] <= i <= seg["last_id"] for i in wanted): continue
+        with gzip.open(archive_dir / seg["file"], "rt", encoding="utf-8") as inp:
+            for line in inp:
+                rec = json.loads(line)
+                if rec["id"] in wanted: found[rec["id"]] = rec
+        if len(found) == len(wanted): break
+    return found
+
+def stats(archive_dir: Path) -> dict:
+    segments = load_index(archive_dir)["segments"].values()
+    return {"segments": len(segments), "rows": sum(s["rows"] for s in segments), "bytes": sum(s.get("bytes", 0) for s in segments)}
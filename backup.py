@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+نسخ احتياطي متسق ومضغوط وتزايدي لقاعدة البيانات + أداة الاستعادة.
+
+- اللقطة تؤخذ عبر واجهة النسخ المباشر في SQLite (لا تلتقط ملفاً نصف مكتوب).
+- النسخة الكاملة: ترويسة JSON ثم محتوى الملف، مضغوطة بـ gzip على دفعات.
+- النسخة التزايدية: ترويسة JSON ثم الصفحات المتغيرة فقط منذ اللقطة السابقة
+  (رقم الصفحة 4 بايت + محتواها).
+
+الاستعادة:
+    python backup.py restore restored.db full-0001.db.gz delta-0002.db.gz delta-0003.db.gz ...
+"""
+
+import os
+import sys
+import json
+import gzip
+import shutil
+import sqlite3
+import struct
+import hashlib
+import argparse
+import datetime
+import tempfile
+from pathlib import Path
+
+CHUNK = 1 << 20            # 1MB لكل دفعة قراءة/ضغط
+FULL_EVERY = 4             # نسخة كاملة كل 4 تشغيلات (يوم واحد بفاصل 6 ساعات)
+STATE_FILE = "state.json"
+
+
+def _page_hash(page: bytes) -> str:
+    return hashlib.blake2b(page, digest_size=16).hexdigest()
+
+def _file_sha(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK), b""): h.update(chunk)
+    return h.hexdigest()
+
+def snapshot(db_path: Path, dest: Path):
+    # واجهة backup تعطي نسخة متسقة حتى مع وجود كتابات جارية (WAL)
+    src = sqlite3.connect(db_path)
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst, pages=1024)
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+        src.close()
+
+def page_hashes(path: Path, page_size: int) -> list:
+    with open(path, "rb") as f:
+        return [_page_hash(p) for p in iter(lambda: f.read(page_size), b"")]
+
+def _page_size(path: Path) -> int:
+    conn = sqlite3.connect(path)
+    try: return conn.execute("PRAGMA page_size").fetchone()[0]
+    finally: conn.close()
+
+def _write_header(out, header: dict):
+    out.write(json.dumps(header).encode("utf-8") + b"\n")
+
+def _read_header(inp) -> dict:
+    return json.loads(inp.readline().decode("utf-8"))
+
+def write_full(snap: Path, dest: Path, header: dict):
+    with open(snap, "rb") as src, gzip.open(dest, "wb") as out:
+        _write_header(out, header)
+        shutil.copyfileobj(src, out, CHUNK)
+
+def write_delta(snap: Path, dest: Path, header: dict, old_hashes: list, new_hashes: list) -> int:
+    page_size = header["page_size"]
+    changed = [i for i, h in enumerate(new_hashes) if i >= len(old_hashes) or old_hashes[i] != h]
+    with open(snap, "rb") as src, gzip.open(dest, "wb") as out:
+        _write_header(out, dict(header, pages=len(changed)))
+        for i in changed:
+            src.seek(i * page_size)
+            out.write(struct.pack(">I", i))
+            out.write(src.read(page_size))
+    return len(changed)
+
+def make_backup(db_path: Path, state_dir: Path, full_every: int = FULL_EVERY) -> tuple:
+    """تأخذ لقطة وتكتب ملف النسخة (كاملة أو تزايدية). تعيد (المسار، الترويسة)."""
+    state_dir.mkdir(parents=True, exist_ok=True)
+    state_path = state_dir / STATE_FILE
+    state = json.loads(state_path.read_text()) if state_path.exists() else {}
+
+    fd, tmp = tempfile.mkstemp(suffix=".db", dir=state_dir)
+    os.close(fd)
+    snap = Path(tmp)
+    try:
+        snapshot(db_path, snap)
+        page_size = _page_size(snap)
+        hashes = page_hashes(snap, page_size)
+        seq = state.get("seq", 0) + 1
+        full = (not state or state.get("page_size") != page_size or (seq - state.get("full_seq", 0)) >= full_every)
+        header = {
+            "type": "full" if full else "delta",
+            "seq": seq,
+            "full_seq": seq if full else state["full_seq"],
+            "base_sha": None if full else state["sha256"],
+            "sha256": _file_sha(snap),
+            "page_size": page_size,
+            "page_count": len(hashes),
+            "created_at": datetime.datetime.now().isoformat(),
+        }
+        dest = state_dir / f"{header['type']}-{seq:04d}.db.gz"
+        if full: write_full(snap, dest, header)
+        else: header["pages"] = write_delta(snap, dest, header, state["hashes"], hashes)
+
+        state = {"seq": seq, "full_seq": header["full_seq"], "sha256": header["sha256"], "page_size": page_size, "hashes": hashes}
+        state_path.write_text(json.dumps(state))
+        return dest, header
+    finally:
+        snap.unlink(missing_ok=True)
+
+def reset_chain(state_dir: Path):
+    # بعد فشل الرفع تصبح السلسلة ناقصة في الأرشيف، فتكون النسخة التالية كاملة
+    (state_dir / STATE_FILE).unlink(missing_ok=True)
+
+def _seq_of(path: Path) -> int:
+    # full-0001.db.gz / delta-0002.db.gz
+    try: return int(Path(path).name.split("-")[1].split(".")[0])
+    except (IndexError, ValueError): return -1
+
+def prune(state_dir: Path, keep_full_seq: int):
+    # الملفات الأقدم من آخر نسخة كاملة لم تعد لازمة محلياً (نسختها موجودة في قناة الأرشيف)
+    for p in state_dir.glob("*.db.gz"):
+        if 0 <= _seq_of(p) < keep_full_seq: p.unlink()
+
+def restore(out_path: Path, files: list) -> dict:
+    """تبني قاعدة البيانات من نسخة كاملة تليها نسخها التزايدية بالترتيب."""
+    files = sorted(files, key=_seq_of)
+    header = None
+    with open(out_path, "wb") as out:
+        for i, fpath in enumerate(files):
+            with gzip.open(fpath, "rb") as inp:
+                h = _read_header(inp)
+                if i == 0:
+                    if h["type"] != "full": raise ValueError(f"{fpath}: أول ملف يجب أن يكون نسخة كاملة")
+                    shutil.copyfileobj(inp, out, CHUNK)
+                else:
+                    if h["type"] != "delta" or h["base_sha"] != header["sha256"]:
+                        raise ValueError(f"{fpath}: لا يتبع النسخة السابقة (seq {header['seq']})")
+                    size = h["page_size"]
+                    for _ in range(h["pages"]):
+                        (page_no,) = struct.unpack(">I", inp.read(4))
+                        out.seek(page_no * size)
+                        out.write(inp.read(size))
+                    out.truncate(h["page_count"] * size)
+                header = h
+    if _file_sha(out_path) != header["sha256"]:
+        raise ValueError("فشل التحقق: البصمة لا تطابق اللقطة الأصلية")
+    conn = sqlite3.connect(out_path)
+    try:
+        if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+            raise ValueError("فشل فحص سلامة قاعدة البيانات المستعادة")
+    finally:
+        conn.close()
+    return header
+
+def main():
+    parser = argparse.ArgumentParser(description="نسخ واستعادة قاعدة البيانات")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("backup", help="أخذ نسخة محلية الآن")
+    p.add_argument("db", type=Path)
+    p.add_argument("state_dir", type=Path)
+    p = sub.add_parser("restore", help="بناء قاعدة البيانات من نسخة كاملة + نسخ تزايدية")
+    p.add_argument("out", type=Path)
+    p.add_argument("files", type=Path, nargs="+")
+    args = parser.parse_args()
+
+    if args.cmd == "backup":
+        dest, header = make_backup(args.db, args.state_dir)
+        print(f"✅ {header['type']} #{header['seq']} → {dest}")
+    else:
+        header = restore(args.out, args.files)
+        print(f"✅ تمت الاستعادة حتى النسخة #{header['seq']} → {args.out}")
+
+if __name__ == "__main__":
+    sys.exit(main())
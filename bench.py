@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+قياس أداء البوت.
+
+- db: المسار القديم لقاعدة البيانات (اتصال جديد + commit على حلقة الأحداث)
+  مقابل AsyncDB (اتصالات دائمة بوضع WAL في خيوط منفصلة) ومقابل التجميع عبر WriteBehind.
+- modes: تشغيل Application كاملاً ضد خادم Bot API محلي بوضعي polling و webhook
+  والتحقق من ترتيب التحديثات لكل مستخدم مع المعالجة المتوازية.
+- load: إعادة تشغيل مزيج حركة واقعي (مسار /start → main_menu → sub_menu → pay_VIP → meth_*
+  → كود الدفع كما في bot.log، تصفح القنوات والدعم، وبث من الأدمن) مع زمن استجابة وحقن flood-wait،
+  وتقرير الإنتاجية وp50/p95/p99 لزمن المعالجة وعدد طلبات API لكل تحديث.
+  تُحفظ النتائج بصيغة JSON في bench_results/ وتُقارن بآخر تشغيل لنفس السيناريو.
+- fleet: عدة بوتات في عملية واحدة (BotFleet) كل منها ضد خادم Bot API محلي خاص به؛
+  حظر البوت الأساسي أثناء الحركة وقياس زمن التحويل ووصول إشعار الأدمن عبر البديل.
+
+الاستخدام:
+    python bench.py db --updates 2000 --concurrency 50 --api-latency 0.02
+    python bench.py modes --users 50 --per-user 10
+    python bench.py load --users 200 --mix funnel --latency 0.03 --flood-rate 0.01 --broadcast
+    python bench.py fleet --bots 3 --users 50
+"""
+
+import json
+import random
+import socket
+import logging
+import subprocess
+import argparse
+import asyncio
+import datetime
+import sqlite3
+import tempfile
+import time
+import contextlib
+from collections import defaultdict, Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+import main
+from fake_bot_api import FakeBotAPI
+
+
+# ─────────────────────────────────────────────
+#  المسار القديم (نسخة من الكود قبل AsyncDB للمقارنة)
+# ─────────────────────────────────────────────
+def legacy_get_db():
+    conn = sqlite3.connect(main.DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def legacy_upsert_user(user):
+    now = datetime.datetime.now().isoformat()
+    conn = legacy_get_db()
+    existing = conn.execute("SELECT user_id FROM users WHERE user_id=?", (user.id,)).fetchone()
+    if not existing:
+        conn.execute("INSERT INTO users (user_id,username,first_name,last_name,join_date,last_seen) VALUES (?,?,?,?,?,?)", (user.id, user.username or "", user.first_name or "", user.last_name or "", now, now))
+    else:
+        conn.execute("UPDATE users SET username=?,first_name=?,last_name=?,last_seen=? WHERE user_id=?", (user.username or "", user.first_name or "", user.last_name or "", now, user.id))
+    conn.commit()
+    conn.close()
+
+def legacy_log_message(user_id, username, first_name, message):
+    now = datetime.datetime.now().isoformat()
+    conn = legacy_get_db()
+    conn.execute("INSERT INTO messages_log (user_id,username,first_name,message,created_at) VALUES (?,?,?,?,?)", (user_id, username or "", first_name or "", message, now))
+    conn.commit()
+    conn.close()
+
+
+# ─────────────────────────────────────────────
+#  محاكاة التحديثات
+# ─────────────────────────────────────────────
+def fake_user(i: int, users: int):
+    uid = 100000 + (i % users)
+    return SimpleNamespace(id=uid, username=f"u{uid}", first_name=f"User {uid}", last_name="")
+
+async def run_updates(handler, updates: int, users: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await handler(fake_user(i, users), i)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(updates)))
+    return updates / (time.perf_counter() - start)
+
+async def bench_db(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        main.DB_PATH = Path(tmp) / "bench.db"
+        main.init_db()
+
+        async def legacy(user, i):
+            legacy_upsert_user(user)
+            await asyncio.sleep(args.api_latency)   # إرسال الرد
+            legacy_log_message(user.id, user.username, user.first_name, f"msg {i}")
+
+        main.DB = main.AsyncDB(main.DB_PATH)
+
+        async def pooled(user, i):
+            await main.DB.execute(main.WriteBehind.UPSERT_SQL, (user.id, user.username, user.first_name, user.last_name, "", ""))
+            await asyncio.sleep(args.api_latency)
+            await main.DB.execute(main.WriteBehind.LOG_SQL, (user.id, user.username, user.first_name, f"msg {i}", ""))
+
+        async def buffered(user, i):
+            await main.db_upsert_user(user)
+            await asyncio.sleep(args.api_latency)
+            await main.db_log_message(user.id, user.username, user.first_name, f"msg {i}")
+
+        before = await run_updates(legacy, args.updates, args.users, args.concurrency)
+        after = await run_updates(pooled, args.updates, args.users, args.concurrency)
+
+        main.WB = main.WriteBehind(main.DB)
+        main.WB.start()
+        batched = await run_updates(buffered, args.updates, args.users, args.concurrency)
+        await main.WB.stop()
+        main.DB.close()
+
+    print(f"updates={args.updates} users={args.users} concurrency={args.concurrency} api_latency={args.api_latency}s")
+    print(f"  before (get_db per call): {before:10.1f} updates/sec")
+    print(f"  after  (AsyncDB):         {after:10.1f} updates/sec  (x{after / before:.2f})")
+    print(f"  after  (write-behind):    {batched:10.1f} updates/sec  (x{batched / before:.2f})")
+
+# ─────────────────────────────────────────────
+#  تشغيل Application كاملاً ضد خادم Bot API محلي
+# ─────────────────────────────────────────────
+def quiet_logging():
+    # لا نكتب ضجيج القياس في bot.log
+    listener = main.LOG_LISTENER
+    listener.handlers = tuple(h for h in listener.handlers if not isinstance(h, logging.FileHandler))
+    for name in ("httpx", "tornado.access", "apscheduler"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+def isolate(tmp: Path):
+    main.DB_PATH = tmp / "bench.db"
+    main.BACKUP_DIR = tmp / "backups"
+    main.ARCHIVE_DIR = tmp / "archive"
+    main.METRICS_PORT = 0
+    main.init_db()
+    main.DB = main.AsyncDB(main.DB_PATH)
+    main.WB = main.WriteBehind(main.DB)
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@contextlib.asynccontextmanager
+async def running_bot(api: FakeBotAPI, mode: str, processor=None):
+    app = main.build_application(api.token, base_url=api.base_url, processor=processor)
+    await app.initialize()
+    await main.on_startup(app)
+    if mode == "webhook":
+        port = free_port()
+        await app.updater.start_webhook(listen="127.0.0.1", port=port, url_path="tg", webhook_url=f"http://127.0.0.1:{port}/tg",
+                                        secret_token="bench-secret", allowed_updates=Update.ALL_TYPES)
+    else:
+        await app.updater.start_polling(poll_interval=0, timeout=1, allowed_updates=Update.ALL_TYPES)
+    await app.start()
+    try:
+        yield app
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await main.on_stop(app)
+        await app.shutdown()
+        await main.on_shutdown(app)
+
+async def wait_for(predicate, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline: raise TimeoutError("انتهت مهلة انتظار المعالجة")
+        await asyncio.sleep(0.01)
+
+async def bench_modes(args):
+    quiet_logging()
+    for mode in ("polling", "webhook"):
+        with tempfile.TemporaryDirectory() as tmp:
+            isolate(Path(tmp))
+            api = await FakeBotAPI().start()
+            seen = defaultdict(list)
+
+            async def record(update, context):
+                seen[update.effective_user.id].append(update.update_id)
+
+            async with running_bot(api, mode) as app:
+                app.add_handler(TypeHandler(Update, record), group=-1)
+                pushed = defaultdict(list)
+                start = time.perf_counter()
+                for i in range(args.per_user):
+                    for uid in range(1, args.users + 1):
+                        pushed[uid].append(api.push_message(10_000 + uid, f"msg {i}")["update_id"])
+                total = args.users * args.per_user
+                await wait_for(lambda: sum(map(len, seen.values())) >= total)
+                elapsed = time.perf_counter() - start
+            await api.stop()
+
+        ordered = all(seen[10_000 + uid] == ids for uid, ids in pushed.items())
+        print(f"{mode:8s} updates={total:5d}  {total / elapsed:8.1f} updates/sec  per-user order preserved: {ordered}")
+
+# ─────────────────────────────────────────────
+#  اختبار الحمل بمزيج حركة واقعي
+# ─────────────────────────────────────────────
+RESULTS_DIR = Path(__file__).parent / "bench_results"
+ADMIN_ID = 1
+METHODS = ("sham", "syria", "usdt")
+
+class TimedProcessor(main.PerUserUpdateProcessor):
+    """يقيس زمن معالجة كل تحديث بعد حصوله على قفل المستخدم."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self.latencies = defaultdict(list)   # نوع التحديث -> [ثوانٍ]
+        self.done = 0
+
+    @staticmethod
+    def kind(update) -> str:
+        if update.callback_query: return "callback:" + update.callback_query.data.split("_")[0]
+        if update.message and update.message.text and update.message.text.startswith("/"): return "command:" + update.message.text.split()[0]
+        return "text"
+
+    async def do_process_update(self, update, coroutine):
+        async def timed():
+            start = time.perf_counter()
+            try: await coroutine
+            finally:
+                self.latencies[self.kind(update)].append(time.perf_counter() - start)
+                self.done += 1
+        await super().do_process_update(update, timed())
+
+def user_script(uid: int, mix: str, rng: random.Random) -> list:
+    funnel = [("command", "/start"), ("callback", "main_menu"), ("callback", "sub_menu"), ("callback", "pay_VIP"),
+              ("callback", f"meth_{rng.choice(METHODS)}"), ("text", f"TX{uid}{rng.randint(1000, 9999)}")]
+    browse = [("command", "/start"), ("callback", "main_menu"), ("callback", "sub_menu"),
+              ("callback", "public_channels"), ("callback", "sub_menu"), ("callback", "main_menu"), ("callback", "support")]
+    chat = [("command", "/start"), ("text", "مرحبا"), ("text", "كيف الاشتراك؟")]
+    if mix == "funnel": return funnel
+    if mix == "browse": return browse
+    # mixed: توزيع تقريبي لما يظهر في bot.log
+    return rng.choices([funnel, browse, chat], weights=[5, 3, 2])[0]
+
+def push(api: FakeBotAPI, uid: int, step):
+    kind, value = step
+    if kind == "command": return api.push_command(uid, value)
+    if kind == "callback": return api.push_callback(uid, value)
+    return api.push_message(uid, value)
+
+def percentile(values: list, p: float) -> float:
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def git_rev() -> str:
+    try: return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent).stdout.strip()
+    except OSError: return ""
+
+def compare_with_previous(result: dict, results_dir: Path):
+    previous = [p for p in sorted(results_dir.glob(f"{result['scenario']}-*.json"))
+                if json.loads(p.read_text()).get("scenario") == result["scenario"]]
+    if not previous: return
+    prev = json.loads(previous[-1].read_text())
+    def delta(key, sub=None):
+        a = prev[key][sub] if sub else prev[key]
+        b = result[key][sub] if sub else result[key]
+        return f"{b:.2f} (قبل {a:.2f}, {(b - a) / a * 100 if a else 0:+.1f}%)"
+    print(f"\nمقارنة مع {previous[-1].name} ({prev.get('git', '')}):")
+    print(f"  throughput:        {delta('throughput')}")
+    print(f"  p95 ms:            {delta('latency_ms', 'p95')}")
+    print(f"  api calls/update:  {delta('api_calls_per_update')}")
+
+async def bench_load(args):
+    quiet_logging()
+    rng = random.Random(args.seed)
+    main.ADMIN_IDS[:] = [ADMIN_ID]
+    if args.channel: main.CHANNEL_ID = -1001234567890
+    with tempfile.TemporaryDirectory() as tmp:
+        isolate(Path(tmp))
+        api = await FakeBotAPI(latency=args.latency, jitter=args.latency / 2, flood_rate=args.flood_rate, seed=args.seed).start()
+        processor = TimedProcessor(main.CONCURRENCY)
+        async with running_bot(api, args.mode, processor) as app:
+            scripts = {10_000 + i: user_script(10_000 + i, args.mix, rng) for i in range(args.users)}
+            total = sum(map(len, scripts.values()))
+            calls_before = api.api_calls
+            start = time.perf_counter()
+            if args.broadcast:
+                # البث يحتاج مستخدمين في القاعدة: نبدأه بعد أول دفعة /start
+                for uid, steps in scripts.items(): push(api, uid, steps[0])
+                await wait_for(lambda: processor.done >= len(scripts), timeout=args.timeout)
+                await main.WB.flush()
+                api.push_message(ADMIN_ID, "بث رسالة اختبار للجميع")
+                total += 1
+                scripts = {uid: steps[1:] for uid, steps in scripts.items()}
+            # تشذير خطوات المستخدمين كما تصل من تيليجرام
+            for i in range(max(map(len, scripts.values()), default=0)):
+                for uid, steps in scripts.items():
+                    if i < len(steps): push(api, uid, steps[i])
+            await wait_for(lambda: processor.done >= total, timeout=args.timeout)
+            if args.broadcast:
+                await wait_for(lambda: api.counts["sendMessage"] >= args.users, timeout=args.timeout)
+                while await main.DB.fetchval("SELECT COUNT(*) FROM broadcasts WHERE status='running'"):
+                    await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - start
+            calls = api.api_calls - calls_before
+        await api.stop()
+
+    all_lat = [v for vals in processor.latencies.values() for v in vals]
+    ms = lambda vals, p: round(percentile(vals, p) * 1000, 2)
+    result = {
+        "scenario": f"{args.mix}-{args.mode}{'-broadcast' if args.broadcast else ''}",
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git": git_rev(),
+        "params": {"users": args.users, "latency": args.latency, "flood_rate": args.flood_rate, "channel": args.channel, "seed": args.seed},
+        "updates": total,
+        "elapsed": round(elapsed, 3),
+        "throughput": round(total / elapsed, 2),
+        "latency_ms": {"p50": ms(all_lat, 50), "p95": ms(all_lat, 95), "p99": ms(all_lat, 99)},
+        "by_kind": {k: {"n": len(v), "p50": ms(v, 50), "p95": ms(v, 95), "p99": ms(v, 99)} for k, v in sorted(processor.latencies.items())},
+        "api_calls_per_update": round(calls / total, 3),
+        "api_calls": dict(Counter({m: n for m, n in api.counts.items() if m not in ("getUpdates", "getMe")})),
+        "floods": dict(api.floods),
+    }
+
+    print(f"scenario={result['scenario']} updates={total} elapsed={result['elapsed']}s")
+    print(f"  throughput:       {result['throughput']:.1f} updates/sec")
+    print(f"  handler latency:  p50={result['latency_ms']['p50']}ms p95={result['latency_ms']['p95']}ms p99={result['latency_ms']['p99']}ms")
+    print(f"  api calls/update: {result['api_calls_per_update']}  {result['api_calls']}  floods={result['floods']}")
+    for k, v in result["by_kind"].items():
+        print(f"    {k:24s} n={v['n']:5d}  p50={v['p50']:8.2f}  p95={v['p95']:8.2f}  p99={v['p99']:8.2f}")
+
+    results_dir = Path(args.out)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    compare_with_previous(result, results_dir)
+    path = results_dir / f"{result['scenario']}-{result['timestamp'].replace(':', '')}.json"
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2))
+    print(f"\n💾 {path}")
+
+# ─────────────────────────────────────────────
+#  عدة بوتات مع التحويل عند الحظر
+# ─────────────────────────────────────────────
+async def bench_fleet(args):
+    quiet_logging()
+    main.ADMIN_IDS[:] = [ADMIN_ID]
+    with tempfile.TemporaryDirectory() as tmp:
+        isolate(Path(tmp))
+        apis = [await FakeBotAPI(token=f"{700000 + i}:FAKE-TOKEN-{i}", latency=args.latency).start() for i in range(args.bots)]
+        specs = [{"name": f"bot{i}", "token": api.token, "base_url": api.base_url} for i, api in enumerate(apis)]
+        fleet = main.BotFleet(specs, mode=args.mode, check_interval=args.check,
+                              webhook={"URL": f"http://127.0.0.1:{free_port()}", "PATH": "tg", "LISTEN": "127.0.0.1"})
+        if args.mode == "webhook": fleet.webhook["PORT"] = int(fleet.webhook["URL"].rsplit(":", 1)[1])
+        await fleet.start()
+        try:
+            def sent(api): return api.counts["sendMessage"]
+            # حركة على كل البوتات معاً (قاعدة بيانات وذاكرات مشتركة)
+            for api in apis:
+                for uid in range(1, args.users + 1):
+                    api.push_command(10_000 + uid, "/start")
+            await wait_for(lambda: all(sent(api) >= args.users for api in apis))
+            await main.WB.flush()
+            users = await main.DB.fetchval("SELECT COUNT(*) FROM users")
+
+            # حظر الأساسي: يُكتشف بالفحص الدوري أو فوراً عبر خطأ الاستقبال
+            before = {i: sent(api) for i, api in enumerate(apis)}
+            t0 = time.perf_counter()
+            apis[0].blocked = True
+            apis[0].push_command(30_000, "/start")   # أول إرسال بعد الحظر يكشفه
+            await wait_for(lambda: fleet.primary not in (None, 0))
+            failover = time.perf_counter() - t0
+            standby = apis[fleet.primary]
+            await wait_for(lambda: any(int(p.get("chat_id", 0)) == ADMIN_ID and "تم التحويل" in p.get("text", "")
+                                       for m, p, _ in standby.calls if m == "sendMessage"))
+            notified = time.perf_counter() - t0
+
+            for uid in range(1, args.users + 1):
+                standby.push_command(20_000 + uid, "/start")
+            await wait_for(lambda: sent(standby) >= before[fleet.primary] + args.users + 1)
+        finally:
+            await fleet.stop()
+            for api in apis: await api.stop()
+
+    print(f"bots={args.bots} mode={args.mode} users/bot={args.users} shared users table={users}")
+    print(f"  failover {fleet.failovers[0][0]} → {fleet.failovers[0][1]}: {failover * 1000:7.1f} ms"
+          f"  (check interval {args.check}s)")
+    print(f"  admin notice via standby:  {notified * 1000:7.1f} ms")
+    print(f"  standby traffic after failover: {args.users} /start handled, blocked bot calls rejected: {sum(apis[0].errors.values())}")
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="قياس أداء البوت")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("db", help="مقارنة طبقة قاعدة البيانات قبل/بعد")
+    p.add_argument("--updates", type=int, default=2000)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=50)
+    p.add_argument("--api-latency", type=float, default=0.02)
+    p.set_defaults(func=bench_db)
+
+    p = sub.add_parser("modes", help="polling و webhook ضد خادم Bot API محلي")
+    p.add_argument("--users", type=int, default=50)
+    p.add_argument("--per-user", type=int, default=10)
+    p.set_defaults(func=bench_modes)
+
+    p = sub.add_parser("load", help="اختبار حمل بمزيج حركة واقعي ضد خادم Bot API محلي")
+    p.add_argument("--users", type=int, default=200)
+    p.add_argument("--mix", choices=("funnel", "browse", "mixed"), default="mixed")
+    p.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    p.add_argument("--latency", type=float, default=0.03, help="زمن استجابة Bot API الوهمي (ثوانٍ)")
+    p.add_argument("--flood-rate", type=float, default=0.0, help="نسبة طلبات الإرسال المرفوضة بـ 429")
+    p.add_argument("--broadcast", action="store_true", help="تشغيل بث من الأدمن أثناء الحمل")
+    p.add_argument("--channel", action="store_true", help="تفعيل التحقق من الاشتراك بالقناة (getChatMember)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--timeout", type=float, default=120)
+    p.add_argument("--out", default=str(RESULTS_DIR))
+    p.set_defaults(func=bench_load)
+
+    p = sub.add_parser("fleet", help="عدة بوتات في عملية واحدة مع التحويل عند حظر الأساسي")
+    p.add_argument("--bots", type=int, default=3)
+    p.add_argument("--users", type=int, default=50)
+    p.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    p.add_argument("--latency", type=float, default=0.01)
+    p.add_argument("--check", type=float, default=10.0, help="فترة فحص getMe (ثوانٍ)")
+    p.set_defaults(func=bench_fleet)
+
+    args = parser.parse_args()
+    asyncio.run(args.func(args))
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+خادم محلي بديل لـ Telegram Bot API لتشغيل البوت واختباره دون الاتصال بتيليجرام.
+
+يدعم وضعي الاستقبال:
+- polling: البوت يسحب التحديثات عبر getUpdates.
+- webhook: بعد setWebhook يدفع الخادم التحديثات إلى عنوان البوت.
+
+ولاختبارات الحمل: زمن استجابة قابل للضبط لكل طريقة (مع تذبذب)، وحقن أخطاء
+flood-wait (429 مع retry_after) بنسبة محددة على طرق الإرسال.
+
+ولاختبار التحويل بين البوتات: blocked = True يجعل كل الطرق ترد 401 كتوكن ملغى،
+ومعرف البوت في getMe مأخوذ من أول جزء في التوكن (خادم لكل توكن).
+
+الاستخدام (داخل حلقة asyncio):
+    api = FakeBotAPI()
+    await api.start()
+    app = main.build_application(api.token, base_url=api.base_url)
+    api.push_command(1001, "/start")
+"""
+
+import json
+import time
+import random
+import asyncio
+import itertools
+from collections import Counter
+
+import httpx
+import tornado.web
+import tornado.netutil
+import tornado.httpserver
+
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+CONTROL_METHODS = {"getMe", "getUpdates", "setWebhook", "deleteWebhook", "getWebhookInfo"}
+FLOOD_METHODS = {"sendMessage", "editMessageText", "sendPhoto", "sendDocument"}
+
+
+class BotAPIError(Exception):
+    def __init__(self, description: str, code: int = 400):
+        super().__init__(description)
+        self.code = code
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"User{uid}", "username": f"user{uid}"}
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, api):
+        self.api = api
+
+    async def post(self, token, method):
+        params = {k: v[-1].decode("utf-8") for k, v in self.request.body_arguments.items()}
+        if self.request.headers.get("Content-Type", "").startswith("application/json") and self.request.body:
+            params = json.loads(self.request.body)
+        for name, files in self.request.files.items():
+            params[name] = files[0]
+        ok, result, extra = await self.api.call(method, params)
+        body = {"ok": ok, **({"result": result} if ok else {"description": result, **extra})}
+        if not ok: self.set_status(extra.get("error_code", 400))
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(body))
+
+    get = post
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, token: str = FAKE_TOKEN,
+                 latency: float = 0.0, jitter: float = 0.0, method_latency: dict = None,
+                 flood_rate: float = 0.0, flood_retry_after: int = 1, seed: int = None):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.latency = latency                      # ثوانٍ لكل طلب (عدا طرق التحكم)
+        self.jitter = jitter                        # ± تذبذب عشوائي
+        self.method_latency = method_latency or {}  # تجاوز الزمن لطرق محددة
+        self.flood_rate = flood_rate                # نسبة طلبات الإرسال التي تُرفض بـ 429
+        self.flood_retry_after = flood_retry_after
+        self.floods = Counter()
+        self._rng = random.Random(seed)
+        self.updates = []               # كل التحديثات المنشأة بالترتيب
+        self._unconfirmed = []          # ما لم يؤكده getUpdates بعد (offset)
+        self.calls = []                 # (method, params, timestamp)
+        self.counts = Counter()
+        self.members = {}               # user_id -> status لـ getChatMember
+        self.rendered = {}              # (chat_id, message_id) -> آخر (نص، أزرار)
+        self.errors = Counter()
+        self.webhook = None             # (url, secret) بعد setWebhook
+        self.blocked = False            # محاكاة توكن ملغى/بوت محظور
+        bot_id = int(token.split(":")[0])
+        self.bot_user = BOT_USER if bot_id == BOT_USER["id"] else {**BOT_USER, "id": bot_id, "username": f"fake_bot_{bot_id}"}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+        self._server = None
+        self._http = None
+        self._outbox = asyncio.Queue()
+        self._deliverer = None
+
+    # ── دورة الحياة ──
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    @property
+    def base_file_url(self) -> str:
+        return f"http://{self.host}:{self.port}/file/bot"
+
+    async def start(self):
+        app = tornado.web.Application([(r"/bot([^/]+)/(\w+)", _MethodHandler, {"api": self})])
+        sockets = tornado.netutil.bind_sockets(self.port, self.host)
+        self.port = sockets[0].getsockname()[1]
+        self._server = tornado.httpserver.HTTPServer(app)
+        self._server.add_sockets(sockets)
+        self._http = httpx.AsyncClient()
+        self._deliverer = asyncio.create_task(self._deliver())
+        return self
+
+    async def stop(self):
+        # إنهاء طلبات getUpdates المعلقة قبل إغلاق الاتصالات
+        self._unconfirmed = []
+        self._new_update.set()
+        await asyncio.sleep(0.05)
+        if self._deliverer:
+            self._deliverer.cancel()
+            try: await self._deliverer
+            except asyncio.CancelledError: pass
+        if self._server:
+            self._server.stop()
+            await self._server.close_all_connections()
+        if self._http: await self._http.aclose()
+
+    # ── توليد التحديثات ──
+    def _message(self, chat_id: int, text: str = None, from_user: dict = None, **extra) -> dict:
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+            **extra,
+        }
+        if from_user: msg["from"] = from_user
+        if text is not None: msg["text"] = text
+        return msg
+
+    def push_update(self, payload: dict) -> dict:
+        update = {"update_id": next(self._update_ids), **payload}
+        self.updates.append(update)
+        self._unconfirmed.append(update)
+        self._new_update.set()
+        if self.webhook: self._outbox.put_nowait(update)
+        return update
+
+    def push_message(self, user_id: int, text: str) -> dict:
+        return self.push_update({"message": self._message(user_id, text, _user(user_id))})
+
+    def push_command(self, user_id: int, command: str) -> dict:
+        msg = self._message(user_id, command, _user(user_id))
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command.split()[0])}]
+        return self.push_update({"message": msg})
+
+    def push_callback(self, user_id: int, data: str, message_id: int = None) -> dict:
+        message = self._message(user_id, "menu", self.bot_user)
+        if message_id: message["message_id"] = message_id
+        return self.push_update({"callback_query": {
+            "id": str(next(self._update_ids)), "from": _user(user_id), "chat_instance": str(user_id),
+            "data": data, "message": message,
+        }})
+
+    async def _deliver(self):
+        # تسليم متسلسل بالترتيب عبر اتصال واحد
+        while True:
+            update = await self._outbox.get()
+            if not self.webhook: continue
+            url, secret = self.webhook
+            headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+            try: await self._http.post(url, json=update, headers=headers)
+            except httpx.HTTPError: pass
+
+    # ── تنفيذ الطرق ──
+    @property
+    def api_calls(self) -> int:
+        # الطلبات "الحقيقية" فقط دون طرق الاستقبال والتحكم
+        return sum(n for m, n in self.counts.items() if m not in CONTROL_METHODS)
+
+    async def call(self, method: str, params: dict):
+        self.calls.append((method, params, time.monotonic()))
+        self.counts[method] += 1
+        if self.blocked:
+            self.errors[method] += 1
+            return False, "Unauthorized", {"error_code": 401}
+        if method not in CONTROL_METHODS:
+            delay = self.method_latency.get(method, self.latency)
+            if self.jitter: delay = max(0.0, delay + self._rng.uniform(-self.jitter, self.jitter))
+            if delay: await asyncio.sleep(delay)
+            if method in FLOOD_METHODS and self.flood_rate and self._rng.random() < self.flood_rate:
+                self.floods[method] += 1
+                return False, f"Too Many Requests: retry after {self.flood_retry_after}", {
+                    "error_code": 429, "parameters": {"retry_after": self.flood_retry_after}}
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None: return True, True, {}
+        try:
+            result = handler(params)
+            if asyncio.iscoroutine(result): result = await result
+        except BotAPIError as e:
+            self.errors[method] += 1
+            return False, str(e), {"error_code": e.code}
+        return True, result, {}
+
+    def api_getMe(self, p):
+        return self.bot_user
+
+    async def api_getUpdates(self, p):
+        offset = int(p.get("offset") or 0)
+        timeout = float(p.get("timeout") or 0)
+        limit = int(p.get("limit") or 100)
+        self._unconfirmed = [u for u in self._unconfirmed if u["update_id"] >= offset]
+        if not self._unconfirmed and timeout > 0:
+            self._new_update.clear()
+            try: await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError: pass
+        return [u for u in self._unconfirmed if u["update_id"] >= offset][:limit]
+
+    def api_setWebhook(self, p):
+        self.webhook = (p["url"], p.get("secret_token"))
+        return True
+
+    def api_deleteWebhook(self, p):
+        self.webhook = None
+        return True
+
+    def api_getWebhookInfo(self, p):
+        return {"url": self.webhook[0] if self.webhook else "", "has_custom_certificate": False, "pending_update_count": 0}
+
+    def api_sendMessage(self, p):
+        return self._message(int(p["chat_id"]), p.get("text", ""), self.bot_user)
+
+    def api_editMessageText(self, p):
+        # مثل تيليجرام: تعديل لا يغير النص ولا الأزرار يُرفض
+        key = (str(p.get("chat_id")), str(p.get("message_id") or p.get("inline_message_id")))
+        content = (p.get("text", ""), json.dumps(p.get("reply_markup"), sort_keys=True))
+        if self.rendered.get(key) == content:
+            raise BotAPIError("Bad Request: message is not modified: specified new message content "
+                              "and reply markup are exactly the same as a current content and reply markup of the message")
+        self.rendered[key] = content
+        msg = self._message(int(p.get("chat_id") or 0), p.get("text", ""), self.bot_user)
+        if p.get("message_id"): msg["message_id"] = int(p["message_id"])
+        return msg
+
+    def api_getChatMember(self, p):
+        uid = int(p["user_id"])
+        return {"status": self.members.get(uid, "member"), "user": _user(uid)}
+
+    def api_sendPhoto(self, p):
+        fid = p["photo"] if isinstance(p.get("photo"), str) else f"photo-{next(self._message_ids)}"
+        return self._message(int(p["chat_id"]), None, self.bot_user, caption=p.get("caption", ""),
+                             photo=[{"file_id": fid, "file_unique_id": fid, "width": 1, "height": 1}])
+
+    def api_sendDocument(self, p):
+        fid = f"doc-{next(self._message_ids)}"
+        return self._message(int(p["chat_id"]), None, self.bot_user, caption=p.get("caption", ""),
+                             document={"file_id": fid, "file_unique_id": fid})
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+مسار السجلات غير الحاجب.
+
+- كل السجلات تمر عبر QueueHandler: حلقة الأحداث تضع السجل في طابور فقط،
+  وخيط مستمع (QueueListener) في الخلفية يتولى التنسيق والكتابة على القرص.
+- تدوير الملف حسب الحجم و/أو الزمن، والملفات المدوَّرة تُضغط بـ gzip
+  (bot.log.1.gz, bot.log.2.gz ...) داخل خيط المستمع.
+- إخفاء الأسرار (توكن البوت يظهر في رابط كل طلب httpx) قبل التنسيق.
+- مستويات منفصلة لكل مسجّل، ومخرجات JSON اختيارية (سطر لكل سجل).
+
+الإعدادات في config.json (كلها اختيارية):
+    "LOGGING": {"file": "bot.log", "level": "INFO", "json": false, "console": true,
+                "rotate_mb": 10, "rotate_hours": 24, "keep": 7,
+                "levels": {"httpx": "WARNING"}}
+"""
+
+import os
+import re
+import json
+import gzip
+import time
+import queue
+import shutil
+import atexit
+import logging
+import datetime
+import logging.handlers
+from pathlib import Path
+
+LOG_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+DEFAULT_LEVELS = {"httpx": "WARNING", "apscheduler": "WARNING"}
+QUEUE_SIZE = 10000
+# توكن تيليجرام: <رقم البوت>:<35 محرفاً تقريباً>
+TOKEN_RE = re.compile(r"(?<!\d)\d{6,}:[A-Za-z0-9_-]{30,}")
+REDACTED = "<redacted>"
+
+
+class RedactingQueueHandler(logging.handlers.QueueHandler):
+    """يدمج الرسالة مع وسائطها ويخفي الأسرار ثم يضعها في الطابور دون حجز."""
+
+    def __init__(self, log_queue, secrets=()):
+        super().__init__(log_queue)
+        self.secrets = [s for s in secrets if s]
+        self.dropped = 0
+
+    def redact(self, text: str) -> str:
+        for secret in self.secrets:
+            text = text.replace(secret, REDACTED)
+        return TOKEN_RE.sub(REDACTED, text)
+
+    def prepare(self, record):
+        # prepare يدمج الوسائط ونص الاستثناء في msg؛ الإخفاء بعده يشمل التتبع أيضاً
+        record = super().prepare(record)
+        record.msg = record.message = self.redact(record.msg)
+        return record
+
+    def enqueue(self, record):
+        try: self.queue.put_nowait(record)
+        except queue.Full: self.dropped += 1   # لا نحجز الحلقة أبداً؛ نُسقط عند الامتلاء
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps({
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }, ensure_ascii=False)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """تدوير عند تجاوز الحجم أو انقضاء المدة، مع ضغط النسخ القديمة."""
+
+    def __init__(self, filename, max_bytes=0, interval=0, backup_count=7, encoding="utf-8"):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.interval = interval
+        self.rollover_at = self._next_rollover()
+
+    def _next_rollover(self) -> float:
+        return time.time() + self.interval if self.interval else float("inf")
+
+    def namer(self, name: str) -> str:
+        return name + ".gz"
+
+    def rotator(self, source: str, dest: str):
+        with open(source, "rb") as src, gzip.open(dest, "wb") as out:
+            shutil.copyfileobj(src, out)
+        os.remove(source)
+
+    def shouldRollover(self, record) -> bool:
+        if time.time() >= self.rollover_at:
+            if self.stream is None: self.stream = self._open()
+            if self.stream.tell() > 0: return True
+            self.rollover_at = self._next_rollover()   # لا ندوّر ملفاً فارغاً
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover()
+
+
+def setup_logging(cfg: dict, base_dir: Path, secrets=()) -> logging.handlers.QueueListener:
+    """يجهّز المسجّل الجذري بطابور ويشغّل خيط الكتابة. يعيد المستمع."""
+    file_name = cfg.get("file", "bot.log")
+    formatter = JsonFormatter() if cfg.get("json") else logging.Formatter(LOG_FORMAT)
+
+    handlers = []
+    if file_name:
+        path = Path(file_name) if os.path.isabs(file_name) else base_dir / file_name
+        handlers.append(CompressingRotatingFileHandler(
+            path,
+            max_bytes=int(float(cfg.get("rotate_mb", 10)) * 1024 * 1024),
+            interval=int(float(cfg.get("rotate_hours", 24)) * 3600),
+            backup_count=int(cfg.get("keep", 7)),
+        ))
+    if cfg.get("console", True):
+        handlers.append(logging.StreamHandler())
+    for h in handlers:
+        h.setFormatter(formatter)
+
+    log_queue = queue.Queue(QUEUE_SIZE)
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(RedactingQueueHandler(log_queue, secrets))
+    root.setLevel(cfg.get("level", "INFO"))
+    for name, level in {**DEFAULT_LEVELS, **cfg.get("levels", {})}.items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_listener, listener)   # تفريغ ما تبقى في الطابور عند الخروج
+    return listener
+
+def stop_listener(listener: logging.handlers.QueueListener):
+    if listener._thread is not None:
+        listener.stop()
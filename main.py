@@ -12,7 +12,15 @@ import json
 import sqlite3
 import logging
 import asyncio
+import time
+import hashlib
 import datetime
+import signal
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from pathlib import Path
 
@@ -22,10 +30,16 @@ from telegram import (
 )
 from telegram.ext import (
     Application, CommandHandler, CallbackQueryHandler,
-    MessageHandler, filters, ContextTypes
+    MessageHandler, ChatMemberHandler, filters, ContextTypes,
+    BaseUpdateProcessor, BasePersistence, PersistenceInput, ExtBot
 )
 from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+from telegram.error import TelegramError, RetryAfter, Forbidden, BadRequest, InvalidToken
+
+import backup
+import archive
+import logpipe
 
 # ─────────────────────────────────────────────
 #  تحميل الإعدادات
@@ -34,6 +48,8 @@ BASE_DIR = Path(__file__).parent
 CONFIG_FILE = BASE_DIR / "config.json"
 CHANNELS_FILE = BASE_DIR / "channels.json"
 DB_PATH = BASE_DIR / "database.db"
+BACKUP_DIR = BASE_DIR / "backups"
+ARCHIVE_DIR = BASE_DIR / "archive"
 
 def load_config() -> dict:
     if not CONFIG_FILE.exists():
@@ -57,17 +73,201 @@ SUPPORT        = CFG.get("SUPPORT", {})
 WALLETS        = CFG.get("WALLETS", {})
 SUBS           = CFG.get("SUBSCRIPTIONS", {})
 BTNS           = CFG.get("BUTTONS", {})
+FLUSH_MS       = int(CFG.get("DB_FLUSH_MS", 500))
+FLUSH_ROWS     = int(CFG.get("DB_FLUSH_ROWS", 200))
+BROADCAST_RATE = float(CFG.get("BROADCAST_RATE", 25))        # رسالة/ثانية (حد تيليجرام العام ~30)
+BROADCAST_CONC = int(CFG.get("BROADCAST_CONCURRENCY", 8))
+MEMBER_TTL     = float(CFG.get("MEMBER_CACHE_TTL", 300))      # ثوانٍ لتخزين نتيجة "مشترك"
+MEMBER_NEG_TTL = float(CFG.get("MEMBER_CACHE_NEG_TTL", 20))   # ثوانٍ لتخزين نتيجة "غير مشترك"
+MEMBER_MAX     = int(CFG.get("MEMBER_CACHE_SIZE", 10000))
+DIGEST_SEC     = float(CFG.get("ADMIN_DIGEST_SEC", 15))        # فاصل ملخص رسائل المستخدمين للأدمن
+DIGEST_MAX     = int(CFG.get("ADMIN_DIGEST_MAX", 25))          # تفريغ فوري عند هذا العدد
+MODE           = CFG.get("MODE", "polling")                      # polling | webhook
+WEBHOOK        = CFG.get("WEBHOOK", {})
+CONCURRENCY    = int(CFG.get("CONCURRENT_UPDATES", 64))
+BOT_API_URL    = CFG.get("BOT_API_URL", "")                      # لخادم Bot API محلي/بديل
+METRICS_HOST   = CFG.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT   = int(CFG.get("METRICS_PORT", 9108))             # 0 لتعطيل نقطة /metrics
+MSG_RETENTION  = int(CFG.get("MSG_RETENTION_DAYS", 30))          # الأقدم يُنقل إلى الأرشيف
+ARCHIVE_BATCH  = int(CFG.get("ARCHIVE_BATCH", 5000))
+STATE_FLUSH_SEC = float(CFG.get("STATE_FLUSH_SEC", 5))          # حفظ حالة المحادثة (user_data)
+SUB_REMIND_HOURS = float(CFG.get("SUB_REMIND_HOURS", 72))        # تذكير بالتجديد قبل الانتهاء
+SUB_BATCH      = int(CFG.get("SUB_BATCH", 500))
+BOTS           = CFG.get("BOTS", [])                              # بوتات احتياطية: [{"NAME": "backup1", "TOKEN": "..."}]
+FAILOVER_CHECK = float(CFG.get("FAILOVER_CHECK_SEC", 10))
 
 # ─────────────────────────────────────────────
 #  إعداد السجل (Logging)
 # ─────────────────────────────────────────────
-logging.basicConfig(
-    format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    level=logging.INFO,
-    handlers=[logging.FileHandler(BASE_DIR / "bot.log", encoding="utf-8"), logging.StreamHandler()]
-)
+# الكتابة على القرص في خيط خلفي؛ التوكن يُخفى من كل السجلات (يظهر في روابط httpx)
+LOG_LISTENER = logpipe.setup_logging(CFG.get("LOGGING", {}), BASE_DIR, secrets=[TOKEN, *(b.get("TOKEN") for b in BOTS)])
 logger = logging.getLogger(__name__)
 
+# ─────────────────────────────────────────────
+#  القياس (Metrics) - بصيغة Prometheus
+# ─────────────────────────────────────────────
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    __slots__ = ("counts", "sum", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.n = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.n += 1
+
+    def quantile(self, q: float) -> float:
+        # تقدير بالحد الأعلى للدلو (يكفي للمقارنة والضبط)
+        target, acc = q * self.n, 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if c and acc >= target: return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return 0.0
+
+class Metrics:
+    """مخزن مقاييس داخل الذاكرة: كل العمليات O(1) على حلقة الأحداث ولا أقفال."""
+
+    def __init__(self):
+        self.histograms = {}    # (name, labels) -> Histogram
+        self.counters = Counter()
+        self.gauges = {}        # name -> دالة تعيد رقماً
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        h = self.histograms.get(key)
+        if h is None: h = self.histograms[key] = Histogram()
+        h.observe(value)
+
+    def inc(self, name: str, n: int = 1, **labels):
+        self.counters[self._key(name, labels)] += n
+
+    def gauge(self, name: str, fn):
+        self.gauges[name] = fn
+
+    @staticmethod
+    def _fmt(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items: return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+    def render(self) -> str:
+        lines, typed = [], set()
+        for (name, labels), h in sorted(self.histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            acc = 0
+            for bound, c in zip(LATENCY_BUCKETS + ("+Inf",), h.counts):
+                acc += c
+                lines.append(f"{name}_bucket{self._fmt(labels, [('le', bound)])} {acc}")
+            lines.append(f"{name}_sum{self._fmt(labels)} {h.sum:.6f}")
+            lines.append(f"{name}_count{self._fmt(labels)} {h.n}")
+        for (name, labels), v in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._fmt(labels)} {v}")
+        for name, fn in sorted(self.gauges.items()):
+            try: value = fn()
+            except Exception: continue
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+# زمن قاعدة البيانات وطلبات API داخل معالج التحديث الحالي
+_SPAN = contextvars.ContextVar("metrics_span", default=None)
+
+def _span_add(kind: str, seconds: float):
+    span = _SPAN.get()
+    if span is not None: span[kind] += seconds
+
+def timed(handler: str, route=None):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            parent = _SPAN.get()
+            span = {"db": 0.0, "api": 0.0}
+            token = _SPAN.set(span)
+            # حالة التحديث كله (على مستوى المعالج الخارجي فقط): ردّ الضغطة المؤجل والطلبات الموفّرة
+            outer = _UPDATE.get() is None
+            update_token = _UPDATE.set({"answer": None, "saved": 0}) if outer else None
+            start = time.perf_counter()
+            try: return await func(update, context, *args, **kwargs)
+            finally:
+                if outer:
+                    state = _UPDATE.get()
+                    await flush_answer(state)
+                    _UPDATE.reset(update_token)
+                    METRICS.inc("bot_updates_total", handler=handler)
+                    if state["saved"]: METRICS.inc("bot_update_saved_calls_total", state["saved"], handler=handler)
+                _SPAN.reset(token)
+                labels = {"handler": handler, "route": route(update) if route else ""}
+                METRICS.observe("bot_handler_seconds", time.perf_counter() - start, **labels)
+                METRICS.observe("bot_handler_db_seconds", span["db"], **labels)
+                METRICS.observe("bot_handler_api_seconds", span["api"], **labels)
+                if parent is not None:
+                    parent["db"] += span["db"]
+                    parent["api"] += span["api"]
+        return wrapper
+    return decorator
+
+def callback_route(update: Update) -> str:
+    data = update.callback_query.data or ""
+    # adm_ok_<uid>_<pid> -> adm_ok (وكذلك صفحات المراجعة) حتى لا تنفجر التسميات
+    return "_".join(p for p in data.split("_") if not p.lstrip("-").isdigit())
+
+class InstrumentedRequest(HTTPXRequest):
+    """عدّ وتوقيت كل طلب صادر إلى Bot API حسب الطريقة."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        status = "error"
+        try:
+            status, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+            return status, payload
+        finally:
+            dt = time.perf_counter() - start
+            METRICS.observe("bot_api_seconds", dt, method=api_method)
+            METRICS.inc("bot_api_calls_total", method=api_method, status=status)
+            if api_method != "getUpdates": _span_add("api", dt)
+
+async def _metrics_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip(): pass
+        path = request_line.split()[1].decode() if len(request_line.split()) > 1 else "/"
+        if path.split("?")[0] == "/metrics":
+            body, status = METRICS.render().encode(), "200 OK"
+        else:
+            body, status = b"not found\n", "404 Not Found"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError): pass
+    finally:
+        writer.close()
+
+async def start_metrics_server():
+    if not METRICS_PORT: return None
+    try:
+        server = await asyncio.start_server(_metrics_client, METRICS_HOST, METRICS_PORT)
+        logger.info(f"📈 Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+        return server
+    except OSError as e:
+        logger.error(f"❌ Metrics server failed to start: {e}")
+        return None
+
 # ─────────────────────────────────────────────
 #  قاعدة البيانات والنسخ الاحتياطي
 # ─────────────────────────────────────────────
@@ -76,6 +276,235 @@ def get_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+class AsyncDB:
+    """طبقة وصول غير متزامنة: خيط كتابة واحد + مجموعة خيوط قراءة، لكل خيط اتصال دائم بوضع WAL."""
+
+    def __init__(self, path, readers: int = 2, cached_statements: int = 256):
+        self.path = path
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._conns = []
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, cached_statements=self.cached_statements)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            with self._lock: self._conns.append(conn)
+        return conn
+
+    async def _submit(self, executor, fn, *args):
+        start = time.perf_counter()
+        try: return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        finally:
+            dt = time.perf_counter() - start
+            METRICS.observe("bot_db_seconds", dt, op="write" if executor is self._writer else "read")
+            _span_add("db", dt)
+
+    # ── الكتابة (خيط واحد، معاملة لكل استدعاء) ──
+    def _tx(self, fn):
+        conn = self._conn()
+        try:
+            result = fn(conn)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    async def transaction(self, fn):
+        return await self._submit(self._writer, self._tx, fn)
+
+    async def execute(self, sql: str, params=()) -> int:
+        return await self.transaction(lambda conn: conn.execute(sql, params).lastrowid)
+
+    async def executemany(self, sql: str, seq) -> int:
+        return await self.transaction(lambda conn: conn.executemany(sql, seq).rowcount)
+
+    # ── القراءة ──
+    async def read(self, fn):
+        return await self._submit(self._readers, lambda: fn(self._conn()))
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchval(self, sql: str, params=()):
+        row = await self.fetchone(sql, params)
+        return row[0] if row else None
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for conn in self._conns:
+                try: conn.close()
+                except sqlite3.Error: pass
+            self._conns.clear()
+
+DB = AsyncDB(DB_PATH)
+
+class WriteBehind:
+    """تجميع كتابات last_seen وسجل الرسائل في الذاكرة وتفريغها كمعاملة واحدة كل FLUSH_MS أو FLUSH_ROWS صف."""
+
+    UPSERT_SQL = (
+        "INSERT INTO users (user_id,username,first_name,last_name,join_date,last_seen) VALUES (?,?,?,?,?,?) "
+        "ON CONFLICT(user_id) DO UPDATE SET username=excluded.username, first_name=excluded.first_name, "
+        "last_name=excluded.last_name, last_seen=excluded.last_seen, is_blocked=0"
+    )
+    LOG_SQL = "INSERT INTO messages_log (user_id,username,first_name,message,created_at) VALUES (?,?,?,?,?)"
+
+    def __init__(self, db: AsyncDB, interval_ms: int = FLUSH_MS, max_rows: int = FLUSH_ROWS):
+        self.db = db
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self._users = {}      # user_id -> صف واحد فقط (آخر قيمة تكفي)
+        self._messages = []
+        self._wake = None
+        self._task = None
+
+    def __len__(self):
+        return len(self._users) + len(self._messages)
+
+    def add_user(self, user, now: str):
+        prev = self._users.get(user.id)
+        join_date = prev[4] if prev else now
+        self._users[user.id] = (user.id, user.username or "", user.first_name or "", user.last_name or "", join_date, now)
+        self._maybe_wake()
+
+    def add_message(self, user_id, username, first_name, message, now: str):
+        self._messages.append((user_id, username or "", first_name or "", message, now))
+        self._maybe_wake()
+
+    def _maybe_wake(self):
+        if self._wake and len(self) >= self.max_rows: self._wake.set()
+
+    async def flush(self):
+        if not len(self): return
+        users, messages = list(self._users.values()), self._messages
+        self._users, self._messages = {}, []
+        def _write(conn):
+            if users: conn.executemany(self.UPSERT_SQL, users)
+            if messages: conn.executemany(self.LOG_SQL, messages)
+        try:
+            await self.db.transaction(_write)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Write-behind flush failed: {e}")
+            # إعادة الصفوف للمخزن دون الكتابة فوق قيم أحدث وصلت أثناء الفشل
+            for row in users: self._users.setdefault(row[0], row)
+            self._messages[:0] = messages
+
+    async def _run(self):
+        while True:
+            try: await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError: pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task: return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        await self.flush()
+
+WB = WriteBehind(DB)
+
+class SQLitePersistence(BasePersistence):
+    """حفظ user_data في جدول user_state: تحميل كسول لكل مستخدم عند أول تحديث له،
+    وكتابة المستخدمين الذين تغيرت بياناتهم فقط، كلهم في معاملة واحدة لكل دورة."""
+
+    UPSERT_SQL = ("INSERT INTO user_state (user_id, data, updated_at) VALUES (?,?,?) "
+                  "ON CONFLICT(user_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at")
+
+    def __init__(self, db: AsyncDB, update_interval: float = STATE_FLUSH_SEC):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self.db = db
+        self._loaded = set()
+        self._written = {}      # user_id -> آخر نص JSON محفوظ
+        self._dirty = {}        # user_id -> نص JSON بانتظار الكتابة (None = حذف)
+        self._writing = None
+
+    # ── تحميل كسول: لا شيء عند الإقلاع ──
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id in self._loaded: return
+        blob = await self.db.fetchval("SELECT data FROM user_state WHERE user_id=?", (user_id,))
+        self._loaded.add(user_id)
+        if blob:
+            self._written[user_id] = blob
+            for k, v in json.loads(blob).items(): user_data.setdefault(k, v)
+
+    # ── كتابة تزايدية مجمعة ──
+    async def update_user_data(self, user_id: int, data: dict):
+        blob = json.dumps(data, ensure_ascii=False, sort_keys=True) if data else None
+        if self._written.get(user_id) == blob: return
+        self._dirty[user_id] = blob
+        await self._commit()
+
+    async def drop_user_data(self, user_id: int):
+        self._dirty[user_id] = None
+        await self._commit()
+
+    async def _commit(self):
+        # Application يستدعي update_user_data لكل المستخدمين معاً (gather)؛ أول استدعاء يجدول
+        # كتابة واحدة تبدأ بعد أن يضع الجميع بياناتهم، والبقية تنتظرها
+        if self._writing is None:
+            self._writing = asyncio.ensure_future(self._write())
+        await self._writing
+
+    async def _write(self):
+        self._writing = None
+        dirty, self._dirty = self._dirty, {}
+        if not dirty: return
+        now = datetime.datetime.now().isoformat()
+        def _tx(conn):
+            conn.executemany(self.UPSERT_SQL, [(uid, blob, now) for uid, blob in dirty.items() if blob is not None])
+            conn.executemany("DELETE FROM user_state WHERE user_id=?", [(uid,) for uid, blob in dirty.items() if blob is None])
+        try:
+            await self.db.transaction(_tx)
+        except sqlite3.Error as e:
+            self._dirty = {**dirty, **self._dirty}   # نعيد المحاولة في الدورة التالية
+            logger.error(f"❌ Persisting user_data failed ({len(dirty)} users): {e}")
+            return
+        for uid, blob in dirty.items():
+            if blob is None: self._written.pop(uid, None)
+            else: self._written[uid] = blob
+
+    async def flush(self):
+        await self._commit()
+
+    # ── بقية أنواع البيانات غير مستخدمة في هذا البوت ──
+    async def get_chat_data(self) -> dict: return {}
+    async def get_bot_data(self) -> dict: return {}
+    async def get_callback_data(self): return None
+    async def get_conversations(self, name: str) -> dict: return {}
+    async def update_conversation(self, name, key, new_state): pass
+    async def update_chat_data(self, chat_id, data): pass
+    async def update_bot_data(self, data): pass
+    async def update_callback_data(self, data): pass
+    async def drop_chat_data(self, chat_id): pass
+    async def refresh_chat_data(self, chat_id, chat_data): pass
+    async def refresh_bot_data(self, bot_data): pass
+
 def init_db():
     conn = get_db()
     c = conn.cursor()
@@ -111,63 +540,496 @@ def init_db():
             message     TEXT,
             created_at  TEXT
         );
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id            INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id      INTEGER,
+            chat_id       INTEGER,
+            status_msg_id INTEGER,
+            message       TEXT,
+            total         INTEGER DEFAULT 0,
+            sent          INTEGER DEFAULT 0,
+            blocked       INTEGER DEFAULT 0,
+            failed        INTEGER DEFAULT 0,
+            last_user_id  INTEGER DEFAULT 0,
+            status        TEXT DEFAULT 'running',
+            created_at    TEXT,
+            updated_at    TEXT
+        );
+        CREATE TABLE IF NOT EXISTS media_cache (
+            path        TEXT,
+            sha256      TEXT,
+            file_id     TEXT,
+            updated_at  TEXT,
+            PRIMARY KEY (path, sha256)
+        );
     """)
     conn.commit()
+    run_migrations(conn)
     conn.close()
 
+def ensure_column(c, table: str, column: str, decl: str):
+    cols = {r[1] for r in c.execute(f"PRAGMA table_info({table})")}
+    if column not in cols:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+# ── ترحيل المخطط: كل خطوة تُنفذ مرة واحدة وتُسجل في PRAGMA user_version ──
+def _hour(col: str) -> str:
+    return f"replace(substr(COALESCE({col}, datetime('now','localtime')), 1, 13), ' ', 'T')"
+
+def _series_bump(metric: str, col: str) -> str:
+    return "\n".join(
+        f"INSERT INTO stats_series (metric, period, bucket, value) VALUES ('{metric}', '{p}', substr({_hour(col)}, 1, {n}), 1) "
+        "ON CONFLICT(metric, period, bucket) DO UPDATE SET value=value+1;"
+        for p, n in (("h", 13), ("d", 10))
+    )
+
+def _counter_add(name: str, expr: str) -> str:
+    return f"UPDATE stats_counters SET value=value+({expr}) WHERE name='{name}';"
+
+def migrate_blocked_flag(c):
+    ensure_column(c, "users", "is_blocked", "INTEGER DEFAULT 0")
+
+def migrate_stats(c):
+    c.executescript(f"""
+        CREATE INDEX IF NOT EXISTS idx_users_sub_status ON users(sub_status);
+        CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status, created_at);
+
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name        TEXT PRIMARY KEY,
+            value       INTEGER DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS stats_series (
+            metric      TEXT,
+            period      TEXT,
+            bucket      TEXT,
+            value       INTEGER DEFAULT 0,
+            PRIMARY KEY (metric, period, bucket)
+        ) WITHOUT ROWID;
+
+        CREATE TRIGGER IF NOT EXISTS trg_users_ins AFTER INSERT ON users BEGIN
+            {_counter_add("users_total", "1")}
+            {_counter_add("users_active", "NEW.sub_status='active'")}
+            {_series_bump("new_users", "NEW.join_date")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_users_del AFTER DELETE ON users BEGIN
+            {_counter_add("users_total", "-1")}
+            {_counter_add("users_active", "-(OLD.sub_status='active')")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_users_sub AFTER UPDATE OF sub_status ON users BEGIN
+            {_counter_add("users_active", "(NEW.sub_status='active') - (OLD.sub_status='active')")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_payments_ins AFTER INSERT ON payments BEGIN
+            {_counter_add("payments_pending", "NEW.status='pending'")}
+            {_series_bump("payments", "NEW.created_at")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_payments_del AFTER DELETE ON payments BEGIN
+            {_counter_add("payments_pending", "-(OLD.status='pending')")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_payments_status AFTER UPDATE OF status ON payments BEGIN
+            {_counter_add("payments_pending", "(NEW.status='pending') - (OLD.status='pending')")}
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_messages_ins AFTER INSERT ON messages_log BEGIN
+            {_series_bump("messages", "NEW.created_at")}
+        END;
+    """)
+    # تعبئة أولية لمرة واحدة من البيانات الموجودة
+    c.execute("DELETE FROM stats_counters")
+    c.execute("DELETE FROM stats_series")
+    for name, sql in (("users_total", "SELECT COUNT(*) FROM users"),
+                      ("users_active", "SELECT COUNT(*) FROM users WHERE sub_status='active'"),
+                      ("payments_pending", "SELECT COUNT(*) FROM payments WHERE status='pending'")):
+        c.execute(f"INSERT INTO stats_counters (name, value) VALUES (?, ({sql}))", (name,))
+    for metric, table, col in (("new_users", "users", "join_date"), ("payments", "payments", "created_at"), ("messages", "messages_log", "created_at")):
+        for period, n in (("h", 13), ("d", 10)):
+            c.execute(f"INSERT INTO stats_series (metric, period, bucket, value) "
+                      f"SELECT ?, ?, substr({_hour(col)}, 1, {n}) AS b, COUNT(*) FROM {table} GROUP BY b", (metric, period))
+
+def migrate_messages_search(c):
+    # فهرس FTS5 بلا محتوى (content=''): يحوي الكلمات فقط ويبقى صالحاً للرسائل بعد أرشفتها،
+    # ومعرف المستخدم عمود مفهرس أيضاً لتصفية سجل مستخدم واحد
+    c.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_messages_user ON messages_log(user_id, created_at);
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            uid, message, content='', tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS trg_messages_fts AFTER INSERT ON messages_log BEGIN
+            INSERT INTO messages_fts (rowid, uid, message) VALUES (NEW.id, NEW.user_id, NEW.message);
+        END;
+
+        INSERT INTO messages_fts (rowid, uid, message) SELECT id, user_id, message FROM messages_log;
+    """)
+
+def migrate_payment_codes(c):
+    # (status, created_at) موجود منذ v2 ويخدم طابور المراجعة؛ هنا فهرس البحث عن الأكواد المكررة
+    ensure_column(c, "payments", "dup_of", "INTEGER")
+    c.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_payments_code ON payments(pay_method, pay_code);
+        UPDATE payments SET dup_of = (
+            SELECT MIN(p.id) FROM payments p
+            WHERE p.pay_method = payments.pay_method AND p.pay_code = payments.pay_code AND p.id < payments.id
+        );
+    """)
+
+def migrate_user_state(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id     INTEGER PRIMARY KEY,
+            data        TEXT,
+            updated_at  TEXT
+        )
+    """)
+
+def migrate_chat_commands(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS chat_commands (
+            chat_id     INTEGER PRIMARY KEY,
+            version     TEXT,
+            updated_at  TEXT
+        )
+    """)
+
+def migrate_multi_bot(c):
+    # file_id ونسخة قائمة الأوامر خاصة بكل بوت؛ الصفوف القديمة تخص البوت الأساسي (رقمه أول جزء من التوكن)
+    primary = int(TOKEN.split(":")[0]) if TOKEN and TOKEN.split(":")[0].isdigit() else 0
+    c.executescript(f"""
+        CREATE TABLE media_cache_new (
+            path        TEXT,
+            sha256      TEXT,
+            bot_id      INTEGER,
+            file_id     TEXT,
+            updated_at  TEXT,
+            PRIMARY KEY (path, sha256, bot_id)
+        );
+        INSERT INTO media_cache_new SELECT path, sha256, {primary}, file_id, updated_at FROM media_cache;
+        DROP TABLE media_cache;
+        ALTER TABLE media_cache_new RENAME TO media_cache;
+
+        CREATE TABLE chat_commands_new (
+            bot_id      INTEGER,
+            chat_id     INTEGER,
+            version     TEXT,
+            updated_at  TEXT,
+            PRIMARY KEY (bot_id, chat_id)
+        ) WITHOUT ROWID;
+        INSERT INTO chat_commands_new SELECT {primary}, chat_id, version, updated_at FROM chat_commands;
+        DROP TABLE chat_commands;
+        ALTER TABLE chat_commands_new RENAME TO chat_commands;
+    """)
+
+def migrate_sub_expiry(c):
+    # NULL = اشتراك دائم. الفهارس جزئية على المشتركين النشطين فقط، فتبقى صغيرة
+    ensure_column(c, "users", "sub_expires", "TEXT")
+    ensure_column(c, "users", "sub_reminded", "INTEGER DEFAULT 0")
+    c.executescript("""
+        CREATE INDEX IF NOT EXISTS idx_users_sub_expires ON users(sub_expires)
+            WHERE sub_status='active' AND sub_expires IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_users_sub_remind ON users(sub_expires)
+            WHERE sub_status='active' AND sub_expires IS NOT NULL AND sub_reminded=0;
+    """)
+
+MIGRATIONS = [
+    migrate_blocked_flag,     # 1
+    migrate_stats,            # 2
+    migrate_messages_search,  # 3
+    migrate_payment_codes,    # 4
+    migrate_user_state,       # 5
+    migrate_sub_expiry,       # 6
+    migrate_chat_commands,    # 7
+    migrate_multi_bot,        # 8
+]
+
+def run_migrations(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for v, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        try:
+            step(conn.cursor())
+            conn.execute(f"PRAGMA user_version={v}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        logger.info(f"🗄 Schema migrated to v{v} ({step.__name__})")
+
+async def run_backup(send_document, chat_id=None):
+    # send_document قابل للاستبدال (مثلاً bot.send_document أو بديل محلي للاختبار)
+    await WB.flush()
+    path, header = await asyncio.to_thread(backup.make_backup, DB_PATH, BACKUP_DIR)
+    now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
+    kind = "كاملة" if header["type"] == "full" else f"تزايدية ({header['pages']} صفحة)"
+    try:
+        with open(path, "rb") as f:
+            await send_document(
+                chat_id=chat_id or BACKUP_CH_ID,
+                document=f,
+                filename=path.name,
+                caption=f"📦 نسخة احتياطية دورية لقاعدة البيانات\n🧩 النوع: {kind} #{header['seq']}\n⏰ الوقت: {now_str}\n🛡 نظام النسخ التلقائي"
+            )
+    except Exception:
+        backup.reset_chain(BACKUP_DIR)
+        raise
+    await asyncio.to_thread(backup.prune, BACKUP_DIR, header["full_seq"])
+    return header
+
 async def backup_database(context: ContextTypes.DEFAULT_TYPE):
     try:
         if not DB_PATH.exists(): return
-        now_str = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
-        with open(DB_PATH, "rb") as f:
-            await context.bot.send_document(
-                chat_id=BACKUP_CH_ID, 
-                document=f, 
-                caption=f"📦 نسخة احتياطية دورية لقاعدة البيانات\n⏰ الوقت: {now_str}\n🛡 نظام النسخ التلقائي"
-            )
-        logger.info("✅ Periodic backup sent successfully.")
+        header = await run_backup(context.bot.send_document)
+        logger.info(f"✅ Periodic backup sent successfully ({header['type']} #{header['seq']}).")
     except Exception as e: 
         logger.error(f"❌ Backup failed: {e}")
 
 # ─────────────────────────────────────────────
 #  دوال قاعدة البيانات
 # ─────────────────────────────────────────────
-def db_upsert_user(user):
-    now = datetime.datetime.now().isoformat()
-    conn = get_db()
-    existing = conn.execute("SELECT user_id FROM users WHERE user_id=?", (user.id,)).fetchone()
-    if not existing:
-        conn.execute("INSERT INTO users (user_id,username,first_name,last_name,join_date,last_seen) VALUES (?,?,?,?,?,?)", (user.id, user.username or "", user.first_name or "", user.last_name or "", now, now))
+async def db_upsert_user(user):
+    WB.add_user(user, datetime.datetime.now().isoformat())
+
+async def db_get_stats():
+    rows = await DB.fetchall("SELECT name, value FROM stats_counters")
+    c = {r["name"]: r["value"] for r in rows}
+    return {"total": c.get("users_total", 0), "active": c.get("users_active", 0), "pending": c.get("payments_pending", 0)}
+
+async def db_get_series(metric: str, period: str = "d", n: int = 7) -> list:
+    # آخر n دلاء (ساعة/يوم) بقراءة نطاق على المفتاح الأساسي، مع أصفار للدلاء الفارغة
+    now = datetime.datetime.now()
+    if period == "h": buckets = [(now - datetime.timedelta(hours=i)).strftime("%Y-%m-%dT%H") for i in range(n - 1, -1, -1)]
+    else: buckets = [(now - datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range(n - 1, -1, -1)]
+    rows = await DB.fetchall("SELECT bucket, value FROM stats_series WHERE metric=? AND period=? AND bucket BETWEEN ? AND ?",
+                             (metric, period, buckets[0], buckets[-1]))
+    found = {r["bucket"]: r["value"] for r in rows}
+    return [found.get(b, 0) for b in buckets]
+
+def sparkline(values: list) -> str:
+    bars = "▁▂▃▄▅▆▇█"
+    top = max(values) or 1
+    return "".join(bars[v * (len(bars) - 1) // top] for v in values)
+
+async def db_log_message(user_id, username, first_name, message):
+    WB.add_message(user_id, username, first_name, message, datetime.datetime.now().isoformat())
+
+# ── أرشفة سجل الرسائل والبحث فيه ──
+MSG_COLUMNS = "id, user_id, username, first_name, message, created_at"
+SEARCH_LIMIT = 20
+
+async def archive_messages(days: int = None) -> int:
+    # ننقل الأقدم من مدة الاحتفاظ إلى مقاطع الأرشيف ثم نحذفه من الجدول الحار
+    await WB.flush()
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=MSG_RETENTION if days is None else days)).isoformat()
+    moved = 0
+    while True:
+        rows = await DB.fetchall(f"SELECT {MSG_COLUMNS} FROM messages_log WHERE created_at < ? ORDER BY id LIMIT ?", (cutoff, ARCHIVE_BATCH))
+        if not rows: break
+        last_id = await asyncio.to_thread(archive.append, ARCHIVE_DIR, [tuple(r) for r in rows])
+        await DB.execute("DELETE FROM messages_log WHERE created_at < ? AND id <= ?", (cutoff, last_id))
+        moved += len(rows)
+        if len(rows) < ARCHIVE_BATCH: break
+    return moved
+
+async def archive_old_messages(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        moved = await archive_messages()
+        if moved: logger.info(f"🗃 Archived {moved} messages older than {MSG_RETENTION} days")
+    except Exception as e:
+        logger.error(f"❌ Message archive failed: {e}")
+
+def fts_query(text: str, user_id: int = None) -> str:
+    # كل كلمة عبارة مقتبسة (لا تُفسَّر رموز FTS5 في نص المدير)، والأخيرة بادئة
+    terms = ['"' + t.replace('"', '""') + '"' for t in text.split()]
+    if terms: terms[-1] += "*"
+    parts = [f'uid : "{user_id}"'] if user_id is not None else []
+    if terms: parts.append("message : (" + " ".join(terms) + ")")
+    return " AND ".join(parts)
+
+async def db_search_messages(text: str, user_id: int = None, limit: int = SEARCH_LIMIT) -> list:
+    """الأحدث أولاً؛ يشمل الرسائل المؤرشفة (تُقرأ من مقاطعها عند الحاجة)."""
+    match = fts_query(text, user_id)
+    if not match: return []
+    ids = [r[0] for r in await DB.fetchall("SELECT rowid FROM messages_fts WHERE messages_fts MATCH ? ORDER BY rowid DESC LIMIT ?", (match, limit))]
+    if not ids: return []
+    hot = {r["id"]: dict(r) for r in await DB.fetchall(
+        f"SELECT {MSG_COLUMNS} FROM messages_log WHERE id IN ({','.join('?' * len(ids))})", ids)}
+    missing = [i for i in ids if i not in hot]
+    if missing: hot.update(await asyncio.to_thread(archive.fetch, ARCHIVE_DIR, missing))
+    return [hot[i] for i in ids if i in hot]
+
+async def db_add_payment(user_id, sub_type, pay_method, pay_code) -> tuple:
+    """تعيد (معرف الطلب، أول طلب سابق بنفس الكود أو None)."""
+    pay_code = pay_code.strip()
+    def _insert(conn):
+        dup = conn.execute("SELECT id, user_id, status FROM payments WHERE pay_method=? AND pay_code=? ORDER BY id LIMIT 1",
+                           (pay_method, pay_code)).fetchone()
+        cur = conn.execute("INSERT INTO payments (user_id, sub_type, pay_method, pay_code, created_at, dup_of) VALUES (?,?,?,?,?,?)",
+                           (user_id, sub_type, pay_method, pay_code, datetime.datetime.now().isoformat(), dup["id"] if dup else None))
+        return cur.lastrowid, dict(dup) if dup else None
+    return await DB.transaction(_insert)
+
+# ── طابور مراجعة الدفعات: ترقيم بالمفتاح (created_at, id) على فهرس (status, created_at) ──
+PAYMENTS_PAGE = 10
+PENDING_SQL = """
+    SELECT p.id, p.user_id, p.sub_type, p.pay_method, p.pay_code, p.created_at, p.dup_of, u.first_name
+    FROM payments p LEFT JOIN users u ON u.user_id = p.user_id
+    WHERE p.status='pending' {where}
+    ORDER BY p.created_at {order}, p.id {order} LIMIT ?
+"""
+KEYSET = "AND (p.created_at, p.id) {} (SELECT created_at, id FROM payments WHERE id=?)"
+AFTER, BEFORE, FROM = KEYSET.format(">"), KEYSET.format("<"), KEYSET.format(">=")
+
+async def db_pending_page(cursor: int = None, direction: str = "n", limit: int = PAYMENTS_PAGE) -> tuple:
+    """صفحة من الطلبات المعلقة: بعد cursor (n) أو قبله (p) أو ابتداءً منه (a).
+    تعيد (الصفوف، يوجد سابق، يوجد تالٍ)."""
+    if cursor is None:
+        rows = await DB.fetchall(PENDING_SQL.format(where="", order="ASC"), (limit,))
+    elif direction == "p":
+        rows = (await DB.fetchall(PENDING_SQL.format(where=BEFORE, order="DESC"), (cursor, limit)))[::-1]
     else:
-        conn.execute("UPDATE users SET username=?,first_name=?,last_name=?,last_seen=? WHERE user_id=?", (user.username or "", user.first_name or "", user.last_name or "", now, user.id))
-    conn.commit()
-    conn.close()
+        rows = await DB.fetchall(PENDING_SQL.format(where=FROM if direction == "a" else AFTER, order="ASC"), (cursor, limit))
+    if not rows and cursor is not None:
+        return await db_pending_page()   # الصفحة فرغت (رُوجعت كلها): نعود للبداية
+    exists = "SELECT EXISTS(SELECT 1 FROM payments p WHERE p.status='pending' {})"
+    has_prev = bool(rows) and bool(await DB.fetchval(exists.format(BEFORE), (rows[0]["id"],)))
+    has_next = bool(rows) and bool(await DB.fetchval(exists.format(AFTER), (rows[-1]["id"],)))
+    return rows, has_prev, has_next
 
-def db_get_stats():
-    conn = get_db()
-    total = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
-    active = conn.execute("SELECT COUNT(*) FROM users WHERE sub_status='active'").fetchone()[0]
-    pending = conn.execute("SELECT COUNT(*) FROM payments WHERE status='pending'").fetchone()[0]
-    conn.close()
-    return {"total": total, "active": active, "pending": pending}
+def activate_subscription(conn, user_id: int, payment_id: int):
+    """تفعيل/تجديد اشتراك داخل معاملة قائمة. المدة من SUBSCRIPTIONS[<type>]["days"] (بدونها: دائم)؛
+    التجديد قبل الانتهاء يُضاف إلى المدة المتبقية."""
+    pay = conn.execute("SELECT sub_type FROM payments WHERE id=?", (payment_id,)).fetchone()
+    sub_type = pay["sub_type"] if pay and pay["sub_type"] else "VIP"
+    days = SUBS.get(sub_type, {}).get("days")
+    expires = None
+    if days:
+        now = datetime.datetime.now()
+        row = conn.execute("SELECT sub_status, sub_expires FROM users WHERE user_id=?", (user_id,)).fetchone()
+        start = now
+        if row and row["sub_status"] == "active" and row["sub_expires"]:
+            start = max(now, datetime.datetime.fromisoformat(row["sub_expires"]))
+        expires = (start + datetime.timedelta(days=float(days))).isoformat()
+    conn.execute("UPDATE users SET sub_status='active', sub_type=?, sub_expires=?, sub_reminded=0 WHERE user_id=?",
+                 (sub_type, expires, user_id))
+    conn.execute("UPDATE payments SET status='approved' WHERE id=?", (payment_id,))
 
-def db_log_message(user_id, username, first_name, message):
-    now = datetime.datetime.now().isoformat()
-    conn = get_db()
-    conn.execute("INSERT INTO messages_log (user_id,username,first_name,message,created_at) VALUES (?,?,?,?,?)", (user_id, username or "", first_name or "", message, now))
-    conn.commit()
-    conn.close()
+async def db_review_range(first_id: int, last_id: int, approve: bool) -> list:
+    """قبول/رفض كل الطلبات المعلقة في مدى الصفحة المعروضة بمعاملة واحدة. تعيد [(user_id, id)]."""
+    def _review(conn):
+        rows = conn.execute(
+            f"SELECT p.id, p.user_id FROM payments p WHERE p.status='pending' {FROM} {KEYSET.format('<=')} LIMIT ?",
+            (first_id, last_id, PAYMENTS_PAGE)).fetchall()
+        ids = [(r["user_id"], r["id"]) for r in rows]
+        if approve:
+            for uid, pid in ids: activate_subscription(conn, uid, pid)
+        else:
+            conn.executemany("UPDATE payments SET status='rejected' WHERE id=?", [(pid,) for _, pid in ids])
+        return ids
+    return await DB.transaction(_review)
+
+async def notify_reviewed(bot, user_ids, **kwargs):
+    for uid in user_ids:
+        try: await LIMITER.send(bot, uid, **kwargs)
+        except TelegramError: pass
+
+def render_pending_page(rows, has_prev: bool, has_next: bool, total: int) -> tuple:
+    if not rows: return "📋 لا توجد طلبات معلقة حالياً.", InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data="adm_main")]])
+    text = f"📋 *طلبات الدفع المعلقة* ({total})\n\n"
+    for p in rows:
+        text += f"#{p['id']} 👤 {p['first_name'] or p['user_id']} | 💎 {p['sub_type']} | 💳 {p['pay_method']}\n🔑 `{p['pay_code']}`"
+        if p["dup_of"]: text += f"  ⚠️ مكرر (#{p['dup_of']})"
+        text += "\n\n"
+    first, last = rows[0]["id"], rows[-1]["id"]
+    nav = []
+    if has_prev: nav.append(InlineKeyboardButton("⬅️ السابق", callback_data=f"adm_pg_p_{first}"))
+    if has_next: nav.append(InlineKeyboardButton("التالي ➡️", callback_data=f"adm_pg_n_{last}"))
+    kbd = [nav] if nav else []
+    kbd.append([InlineKeyboardButton("✅ قبول الصفحة", callback_data=f"adm_bulk_ok_{first}_{last}"),
+                InlineKeyboardButton("❌ رفض الصفحة", callback_data=f"adm_bulk_no_{first}_{last}")])
+    kbd.append([InlineKeyboardButton("🔙 رجوع", callback_data="adm_main")])
+    return text, InlineKeyboardMarkup(kbd)
 
 # ─────────────────────────────────────────────
 #  مساعدات عامة
 # ─────────────────────────────────────────────
+MEMBER_STATUSES = ("member", "creator", "administrator")
+
+class MembershipCache:
+    """ذاكرة LRU محدودة الحجم لنتائج getChatMember مع TTL إيجابي/سلبي ودمج الطلبات المتزامنة."""
+
+    def __init__(self, ttl: float = MEMBER_TTL, neg_ttl: float = MEMBER_NEG_TTL, max_size: int = MEMBER_MAX):
+        self.ttl = ttl
+        self.neg_ttl = neg_ttl
+        self.max_size = max_size
+        self._data = OrderedDict()   # user_id -> (is_member, expires_at)
+        self._inflight = {}          # user_id -> Future
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        entry = self._data.get(user_id)
+        if entry is None: return None
+        if entry[1] < time.monotonic():
+            del self._data[user_id]
+            return None
+        self._data.move_to_end(user_id)
+        return entry[0]
+
+    def set(self, user_id, is_member: bool):
+        self._data[user_id] = (is_member, time.monotonic() + (self.ttl if is_member else self.neg_ttl))
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._data.pop(user_id, None)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+    async def lookup(self, user_id, fetch):
+        cached = self.get(user_id)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        fut = self._inflight.get(user_id)
+        if fut is not None:
+            return await asyncio.shield(fut)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = fut
+        try:
+            result = await fetch()
+            if result is not None: self.set(user_id, result)
+            fut.set_result(bool(result))
+        except BaseException:
+            fut.set_result(False)
+            raise
+        finally:
+            del self._inflight[user_id]
+        return bool(result)
+
+MEMBERS = MembershipCache()
+
 async def is_subscribed(bot, user_id: int) -> bool:
     if user_id in ADMIN_IDS: return True
     if not CHANNEL_ID: return True # تخطي التحقق إذا لم يتم ضبط القناة
-    try:
-        member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
-        return member.status in ("member", "creator", "administrator")
-    except TelegramError: return False
+
+    async def fetch():
+        try:
+            member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=user_id)
+            return member.status in MEMBER_STATUSES
+        except TelegramError: return None   # لا نخزّن الأخطاء المؤقتة
+
+    return await MEMBERS.lookup(user_id, fetch)
+
+@timed("handle_chat_member")
+async def handle_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # تحديث فوري للذاكرة عند انضمام/مغادرة مستخدم للقناة
+    cmu = update.chat_member
+    if cmu.chat.id != CHANNEL_ID: return
+    MEMBERS.set(cmu.new_chat_member.user.id, cmu.new_chat_member.status in MEMBER_STATUSES)
 
 def admin_only(func):
     @wraps(func)
@@ -181,12 +1043,597 @@ async def safe_send(bot, chat_id, **kwargs):
     try: return await bot.send_message(chat_id=chat_id, **kwargs)
     except TelegramError: return None
 
+def retry_seconds(e: RetryAfter) -> float:
+    ra = e.retry_after
+    return ra.total_seconds() if isinstance(ra, datetime.timedelta) else float(ra)
+
+class RateLimiter:
+    """دلو رموز للحد العام + فاصل أدنى لكل محادثة، مع إيقاف مؤقت عند flood-wait."""
+
+    def __init__(self, rate: float, per_chat_interval: float = 1.0, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.per_chat_interval = per_chat_interval
+        self._tokens = self.capacity
+        self._ts = time.monotonic()
+        self._paused_until = 0.0
+        self._last_chat = {}
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def _wait_chat(self, chat_id):
+        last = self._last_chat.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - time.monotonic()
+            if delay > 0: await asyncio.sleep(delay)
+        self._last_chat[chat_id] = time.monotonic()
+        if len(self._last_chat) > 10000:
+            cutoff = time.monotonic() - self.per_chat_interval
+            self._last_chat = {k: v for k, v in self._last_chat.items() if v > cutoff}
+
+    async def acquire(self, chat_id=None):
+        if chat_id is not None: await self._wait_chat(chat_id)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+                self._ts = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def send(self, bot, chat_id, attempts: int = 5, **kwargs):
+        # يرفع Forbidden/TelegramError للمستدعي، ويعيد المحاولة بعد RetryAfter
+        for attempt in range(attempts):
+            await self.acquire(chat_id)
+            try:
+                return await bot.send_message(chat_id=chat_id, **kwargs)
+            except RetryAfter as e:
+                wait = retry_seconds(e)
+                logger.warning(f"⏳ Flood wait {wait}s (chat {chat_id})")
+                self.pause(wait)
+                if attempt == attempts - 1: raise
+
+LIMITER = RateLimiter(BROADCAST_RATE)
+
+# ─────────────────────────────────────────────
+#  محرك البث الجماعي (مهمة خلفية قابلة للاستئناف)
+# ─────────────────────────────────────────────
+BROADCAST_BATCH = 200
+BROADCAST_EDIT_EVERY = 3.0   # ثوانٍ بين تحديثات رسالة التقدم
+
+async def db_create_broadcast(admin_id, chat_id, status_msg_id, message, total) -> int:
+    now = datetime.datetime.now().isoformat()
+    return await DB.execute("INSERT INTO broadcasts (admin_id, chat_id, status_msg_id, message, total, created_at, updated_at) VALUES (?,?,?,?,?,?,?)",
+                            (admin_id, chat_id, status_msg_id, message, total, now, now))
+
+async def _broadcast_one(bot, uid, text, sem) -> str:
+    async with sem:
+        try:
+            await LIMITER.send(bot, uid, text=text, parse_mode=ParseMode.MARKDOWN)
+            return "sent"
+        except InvalidToken: raise   # البوت نفسه محظور: نتوقف عند آخر نقطة حفظ ليستأنف البديل
+        except Forbidden: return "blocked"
+        except TelegramError: return "failed"
+
+async def _broadcast_progress(bot, b, text):
+    try: await bot.edit_message_text(chat_id=b["chat_id"], message_id=b["status_msg_id"], text=text)
+    except TelegramError: pass
+
+async def run_broadcast(bot, bid: int):
+    b = dict(await DB.fetchone("SELECT * FROM broadcasts WHERE id=?", (bid,)))
+    text = f"💬 *رســالــة مــن الإدارة 📩:*\n\n{b['message']}"
+    sem = asyncio.Semaphore(BROADCAST_CONC)
+    last_edit = time.monotonic()
+    while True:
+        batch = [r[0] for r in await DB.fetchall("SELECT user_id FROM users WHERE user_id>? AND is_blocked=0 ORDER BY user_id LIMIT ?", (b["last_user_id"], BROADCAST_BATCH))]
+        if not batch: break
+        results = await asyncio.gather(*(_broadcast_one(bot, uid, text, sem) for uid in batch))
+        blocked_ids = [(uid,) for uid, r in zip(batch, results) if r == "blocked"]
+        b["sent"] += results.count("sent")
+        b["blocked"] += len(blocked_ids)
+        b["failed"] += results.count("failed")
+        b["last_user_id"] = batch[-1]
+
+        # نقطة حفظ بعد كل دفعة: إعادة التشغيل تستأنف من آخر مستخدم بدل الإرسال من جديد
+        def _checkpoint(conn):
+            if blocked_ids: conn.executemany("UPDATE users SET is_blocked=1 WHERE user_id=?", blocked_ids)
+            conn.execute("UPDATE broadcasts SET sent=?, blocked=?, failed=?, last_user_id=?, updated_at=? WHERE id=?",
+                         (b["sent"], b["blocked"], b["failed"], b["last_user_id"], datetime.datetime.now().isoformat(), bid))
+        await DB.transaction(_checkpoint)
+
+        if time.monotonic() - last_edit >= BROADCAST_EDIT_EVERY:
+            last_edit = time.monotonic()
+            done = b["sent"] + b["blocked"] + b["failed"]
+            await _broadcast_progress(bot, b, f"⏳ جاري الإرسال... {done}/{b['total']}\n✅ {b['sent']} | 🚫 {b['blocked']} | ⚠️ {b['failed']}")
+
+    await DB.execute("UPDATE broadcasts SET status='done', updated_at=? WHERE id=?", (datetime.datetime.now().isoformat(), bid))
+    await _broadcast_progress(bot, b, f"✅ تم الإرسال لـ {b['sent']} مستخدم\n🚫 {b['blocked']} مستخدمين حظروا البوت\n⚠️ {b['failed']} فشل")
+    logger.info(f"📣 Broadcast #{bid} finished: sent={b['sent']} blocked={b['blocked']} failed={b['failed']}")
+
+async def resume_broadcasts(context: ContextTypes.DEFAULT_TYPE):
+    for r in await DB.fetchall("SELECT id FROM broadcasts WHERE status='running'"):
+        logger.info(f"🔁 Resuming broadcast #{r['id']}")
+        context.application.create_task(run_broadcast(context.bot, r["id"]))
+
+# ─────────────────────────────────────────────
+#  انتهاء الاشتراكات (مؤقت واحد يستيقظ عند أقرب موعد)
+# ─────────────────────────────────────────────
+EXPIRY_JOB = "sub_expiry"
+EXPIRY_MAX_SLEEP = 86400     # شبكة أمان: مراجعة يومية حتى لو لم يوجد موعد
+
+# INDEXED BY: دون ANALYZE يفضّل المخطط idx_users_sub_status ثم يفرز كل المشتركين
+DUE_EXPIRE_SQL = ("SELECT user_id, sub_type, sub_expires FROM users INDEXED BY idx_users_sub_expires "
+                  "WHERE sub_status='active' AND sub_expires IS NOT NULL AND sub_expires <= ? ORDER BY sub_expires LIMIT ?")
+DUE_REMIND_SQL = ("SELECT user_id, sub_type, sub_expires FROM users INDEXED BY idx_users_sub_remind "
+                  "WHERE sub_status='active' AND sub_expires IS NOT NULL AND sub_reminded=0 AND sub_expires > ? AND sub_expires <= ? "
+                  "ORDER BY sub_expires LIMIT ?")
+_EXPIRY_LOCK = asyncio.Lock()
+
+async def db_next_expiry_due() -> datetime.datetime:
+    # أقرب انتهاء أو أقرب تذكير (قبل الانتهاء بـ SUB_REMIND_HOURS)؛ قراءتان من الفهرسين الجزئيين
+    expire = await DB.fetchval("SELECT MIN(sub_expires) FROM users INDEXED BY idx_users_sub_expires "
+                               "WHERE sub_status='active' AND sub_expires IS NOT NULL")
+    remind = await DB.fetchval("SELECT MIN(sub_expires) FROM users INDEXED BY idx_users_sub_remind "
+                               "WHERE sub_status='active' AND sub_expires IS NOT NULL AND sub_reminded=0 AND sub_expires > ?",
+                               (datetime.datetime.now().isoformat(),))
+    due = [datetime.datetime.fromisoformat(expire)] if expire else []
+    if remind: due.append(datetime.datetime.fromisoformat(remind) - datetime.timedelta(hours=SUB_REMIND_HOURS))
+    return min(due) if due else None
+
+def _renew_kbd(sub_type: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🔄 تجديد الاشتراك", callback_data=f"pay_{sub_type}")]])
+
+async def _send_quietly(bot, chat_id, **kwargs):
+    try: await LIMITER.send(bot, chat_id, **kwargs)
+    except TelegramError: pass
+
+async def revoke_access(bot, user_id: int, channels):
+    # طرد دون حظر دائم: ban ثم unban يسمح بالعودة بعد التجديد
+    for ch in channels:
+        try:
+            await LIMITER.acquire(user_id)
+            await bot.ban_chat_member(chat_id=ch, user_id=user_id)
+            await bot.unban_chat_member(chat_id=ch, user_id=user_id, only_if_banned=True)
+        except TelegramError as e:
+            logger.warning(f"⚠️ Could not revoke {user_id} from {ch}: {e}")
+
+async def process_expiry(bot) -> tuple:
+    """دفعات من SUB_BATCH: التذكيرات المستحقة ثم الاشتراكات المنتهية. تعيد (تذكيرات، انتهاءات)."""
+    async with _EXPIRY_LOCK:
+        return await _process_expiry(bot)
+
+async def _process_expiry(bot) -> tuple:
+    reminded = expired = 0
+    now = datetime.datetime.now()
+    lead = (now + datetime.timedelta(hours=SUB_REMIND_HOURS)).isoformat()
+    while True:
+        # المنتهي فعلاً لا يُذكَّر؛ تصله رسالة الانتهاء أدناه
+        rows = await DB.fetchall(DUE_REMIND_SQL, (now.isoformat(), lead, SUB_BATCH))
+        if not rows: break
+        # نعلّم قبل الإرسال: تذكير مفقود أهون من تكراره بعد إعادة تشغيل
+        await DB.executemany("UPDATE users SET sub_reminded=1 WHERE user_id=?", [(r["user_id"],) for r in rows])
+        await asyncio.gather(*(_send_quietly(
+            bot, r["user_id"], reply_markup=_renew_kbd(r["sub_type"]),
+            text=f"⏳ ينتهي اشتراكك {r['sub_type']} بتاريخ {r['sub_expires'][:16].replace('T', ' ')}.\n"
+                 "جدّد الآن للحفاظ على وصولك للقنوات الخاصة 👇") for r in rows))
+        reminded += len(rows)
+        if len(rows) < SUB_BATCH: break
+
+    while True:
+        now = datetime.datetime.now().isoformat()
+        rows = await DB.fetchall(DUE_EXPIRE_SQL, (now, SUB_BATCH))
+        if not rows: break
+        def _expire(conn):
+            # الشرط يتكرر: من جدّد بين القراءة والكتابة لا يُمس
+            conn.executemany("UPDATE users SET sub_status='expired' WHERE user_id=? AND sub_status='active' AND sub_expires <= ?",
+                             [(r["user_id"], now) for r in rows])
+        await DB.transaction(_expire)
+        async def _one(r):
+            await revoke_access(bot, r["user_id"], SUBS.get(r["sub_type"], {}).get("channels", []))
+            await _send_quietly(bot, r["user_id"], reply_markup=_renew_kbd(r["sub_type"]),
+                                text=f"⌛️ انتهى اشتراكك {r['sub_type']} وتم إيقاف الوصول للقنوات الخاصة.\nيمكنك التجديد في أي وقت 👇")
+        await asyncio.gather(*(_one(r) for r in rows))
+        expired += len(rows)
+        if len(rows) < SUB_BATCH: break
+    return reminded, expired
+
+async def expiry_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        reminded, expired = await process_expiry(context.bot)
+        if reminded or expired: logger.info(f"⌛️ Subscriptions: {reminded} reminded, {expired} expired")
+    except Exception as e:
+        logger.error(f"❌ Expiry run failed: {e}")
+    await reschedule_expiry(context.job_queue)
+
+async def reschedule_expiry(job_queue):
+    due = await db_next_expiry_due()
+    delay = EXPIRY_MAX_SLEEP if due is None else (due - datetime.datetime.now()).total_seconds()
+    delay = min(max(delay, 1), EXPIRY_MAX_SLEEP)
+    for job in job_queue.get_jobs_by_name(EXPIRY_JOB): job.schedule_removal()
+    job_queue.run_once(expiry_job, when=delay, name=EXPIRY_JOB)
+
+def schedule_expiry():
+    # بعد تفعيل جديد قد يصبح أقرب موعد أبكر من المؤقت الحالي (على طابور مهام البوت الأساسي)
+    if JOB_QUEUE: asyncio.get_running_loop().create_task(reschedule_expiry(JOB_QUEUE))
+
+# ─────────────────────────────────────────────
+#  إشعارات الأدمن (طابور خلفي + ملخصات)
+# ─────────────────────────────────────────────
+TG_MAX_TEXT = 4096
+
+class AdminNotifier:
+    """رسائل المستخدمين تُجمع في ملخص دوري، وطلبات الدفع تُرسل فوراً بالتوازي لكل الأدمن دون انتظار المعالج."""
+
+    def __init__(self, limiter: RateLimiter, interval: float = DIGEST_SEC, max_items: int = DIGEST_MAX):
+        self.limiter = limiter
+        self.interval = interval
+        self.max_items = max_items
+        self.bot = None
+        self._pending = []
+        self._inflight = set()
+        self._wake = None
+        self._task = None
+        self._closing = False
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending) + len(self._inflight)
+
+    def notify(self, user, text: str):
+        self._pending.append((user.first_name, user.id, text))
+        if self._wake and len(self._pending) >= self.max_items: self._wake.set()
+
+    def urgent(self, **kwargs):
+        task = asyncio.create_task(self._fanout(kwargs))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, aid, kwargs):
+        try: await self.limiter.send(self.bot, aid, **kwargs)
+        except TelegramError as e: logger.warning(f"⚠️ Admin notify to {aid} failed: {e}")
+
+    async def _fanout(self, kwargs):
+        await asyncio.gather(*(self._send(aid, kwargs) for aid in ADMIN_IDS))
+
+    def _digest_chunks(self, items) -> list:
+        if len(items) == 1:
+            name, uid, text = items[0]
+            return [f"👁 *رسالة من:* {name} ({uid})\n💬 {text}"[:TG_MAX_TEXT]]
+        chunks, cur = [], f"👁 *ملخص رسائل المستخدمين ({len(items)}):*\n"
+        for name, uid, text in items:
+            line = f"\n• {name} ({uid}): {text}"[:1000]
+            if len(cur) + len(line) > TG_MAX_TEXT:
+                chunks.append(cur)
+                cur = ""
+            cur += line
+        chunks.append(cur)
+        return chunks
+
+    async def flush(self):
+        if not self._pending or not self.bot: return
+        items, self._pending = self._pending, []
+        for chunk in self._digest_chunks(items):
+            await self._fanout({"text": chunk})
+
+    async def _run(self):
+        while not self._closing:
+            try: await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError: pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self, bot):
+        self.bot = bot
+        if self._task: return
+        self._closing = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # لا نلغي المهمة أثناء الإرسال حتى لا يضيع ملخص مسحوب من الطابور
+        if self._task:
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._inflight: await asyncio.gather(*self._inflight, return_exceptions=True)
+
+NOTIFIER = AdminNotifier(LIMITER)
+
+# ─────────────────────────────────────────────
+#  القوائم الجاهزة (تُبنى مرة واحدة وتُعاد عند تعديل الملفات)
+# ─────────────────────────────────────────────
+RELOAD_INTERVAL = float(CFG.get("RELOAD_INTERVAL", 5))   # ثوانٍ بين فحوص mtime
+
+def build_menus(cfg: dict, channels: list) -> dict:
+    subs, btns = cfg.get("SUBSCRIPTIONS", {}), cfg.get("BUTTONS", {})
+    wallets, support = cfg.get("WALLETS", {}), cfg.get("SUPPORT", {})
+    md = ParseMode.MARKDOWN
+    menus = {}
+
+    menus["main_menu"] = (
+        "*مــرحــبــاً {first_name}* ✨\n\n\n*يـــرجـــى اخـــتـــيــار:*\n\n1️⃣ للإشتراك في *👑الــقــنــوات الــخــاصــة👑* أو الدخول المجاني للقنوات العامة.\n\n2️⃣ للتواصل المباشر معنا عبر الواتساب.\n\n❤️❤️❤️❤️",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton(btns.get("btn_subscriptions", "💎 قـنـواتـنـا الـخـاصـة و العامّة"), callback_data="sub_menu")],
+            [InlineKeyboardButton(btns.get("btn_support", "📞 الـتـواصـل الـمـبـاشر مـع الـدعـم"), callback_data="support")],
+            [InlineKeyboardButton(btns.get("btn_end", "❌ إنــهــاء"), callback_data="end")]
+        ]), md)
+
+    menus["sub_menu"] = (
+        "💯🔥 *اخــتــر الاشــتــراك الــمــطــلــوب* 🔥💯\n\n\n*-👑اشـتـراك VIP الـمـمـيـز👑*:\nيمنحك الوصول لكافة القنوات الخاصة والمحتوى الخاص بالكامل (التفاصيل بالداخل).\n\n-القنوات العامة:\n متاحة للجميع مجاناً , والقائمة متغيّرة باستمرار نتيجة حظر.\n\n ❤️❤️❤️❤️",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton(subs.get("VIP", {}).get("label", "👑 اشـتـراك VIP الـمـمـيـز 👑"), callback_data="pay_VIP")],
+            [InlineKeyboardButton("📺 قـنـواتـنـا الـعـامـة 📺 ", callback_data="public_channels")],
+            [InlineKeyboardButton(btns.get("btn_back", "🔙 رجـــــوع 🔙 "), callback_data="main_menu")]
+        ]), md)
+
+    for sub_key in set(subs) | {"VIP"}:
+        label = subs.get(sub_key, {}).get("label", sub_key)
+        price_usd = subs.get(sub_key, {}).get("price_usd", 25)
+        text = (
+            f"💎 *الـفـئـة:* {label}\n"
+            f"\n💰 الـتـكـلـفـة: {price_usd}$"
+            "*\nاخـتـر وسـيـلـة الـدفـع👇👇*\n\n"
+            "(إن لم تجد طريقة الدفع المتاحة لديك، تواصل معنا، نؤمن الاستلام من جميع انحاء العالم وبكل الطرق 👌🔥)"
+        )
+        menus[f"pay_{sub_key}"] = (text, InlineKeyboardMarkup([
+            [InlineKeyboardButton(btns.get("btn_sham", "💳 شـام كاش"), callback_data="meth_sham"),
+             InlineKeyboardButton(btns.get("btn_syriatel", "📱 سـيـريـتـل كـاش"), callback_data="meth_syria")],
+            [InlineKeyboardButton(btns.get("btn_usdt", "🪙 عـمـلات رقـمـيـة USDT"), callback_data="meth_usdt")],
+            [InlineKeyboardButton("📝 تــفــاصــيــل الاشــتــراك 📝 ", callback_data="sub_details")],
+            [InlineKeyboardButton(btns.get("btn_back", "🔙 رجــوع"), callback_data="sub_menu")]
+        ]), md)
+
+    menus["sub_details"] = (
+        subs.get("VIP", {}).get("details", "اشتراك VIP يمنحك الوصول لكافة القنوات الخاصة بشكل دائم."),
+        InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجــوع", callback_data="pay_VIP")]]), md)
+
+    back_kbd = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data="pay_VIP")]])
+    menus["meth_sham"] = (f"💳 *شــام كــاش*\n\nقـم بـتـحـويـل 25$ أو 3500 ل.س جـديـدة إلى:\n\n`{wallets.get('sham_cash')}`\n\nأســم الــحــســاب: {wallets.get('sham_account_name')}\n\n\n*ثـم أرسـل رقـم الـعـمـلـيـة هـنـا 👇*", back_kbd, md)
+    menus["meth_syria"] = (f"📱 *ســيــريــتــل كــاش*\n\nقـم بـتـحـويـل 3500 ل.س جـديـدة إلى:\n\n`{wallets.get('syriatel_cash')}`\n\n*ثـم أرسـل رقـم الـعـمـلـيـة هـنـا 👇*", back_kbd, md)
+    menus["meth_usdt"] = (f"🪙 *USDT*\n\nقــم بــتــحــويــل 25$ إلــى أحـد الـمـحـافـظ الـتـالـيـة:\n\nBEP20:\n `{wallets.get('usdt_bep20')}`\n\nTRC20:\n `{wallets.get('usdt_trc20')}`\n\nيمكنك التواصل مع الدعم للتحويل المباشر (خارج السلسلة) إلى بينانس أو كوين اكس أو تراست والت أو سي والت .\nبالإضافة إلى شبكات: Erc20 ETH - TON .\n\n*ثـم أرسـل TxID هـنـا 👇*", back_kbd, md)
+
+    if not channels:
+        menus["public_channels"] = ("لا توجد قنوات حالياً.", InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data="sub_menu")]]), None)
+    else:
+        # عرض القنوات كمربعات (3 في كل صف)
+        kbd = [[InlineKeyboardButton(ch["name"], url=ch["url"]) for ch in channels[i:i + 3]] for i in range(0, len(channels), 3)]
+        kbd.append([InlineKeyboardButton("🔙 رجــوع", callback_data="sub_menu")])
+        menus["public_channels"] = ("📺 قــنــواتــنــا الــعــامــة 🔥🔥\n\n-نقوم بتغيير هذه القائمة باستمرار. \n\n-سيكون لكل قناة محتوى خاص بها. 🔥\n\n-يمكنك الاشتراك بهم جميعاً لتبقى معنا.\n\n\nاضغط على اي قناة في الاسفل للانتقال إليها👇👇👇:", InlineKeyboardMarkup(kbd), None)
+
+    menus["support"] = (
+        "📞 تـواصـل مـعـنـا مـبـاشـرة عبر الواتساب:",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton(f"💬 {support.get('label1')} - واتـسـاب", url=f"https://wa.me/{support.get('whatsapp1')}")],
+            [InlineKeyboardButton(f"💬 {support.get('label2')} - واتـسـاب", url=f"https://wa.me/{support.get('whatsapp2')}")],
+            [InlineKeyboardButton("🔙 رجــوع", callback_data="main_menu")]
+        ]), None)
+    return menus
+
+class RenderCache:
+    """نصوص ولوحات أزرار جاهزة؛ يعاد بناؤها كاملة ثم تُبدّل بمرجع واحد عند تغيّر mtime للملفات."""
+
+    def __init__(self, files):
+        self.files = files
+        self._stamp = None
+        self.menus = {}
+
+    def _mtimes(self):
+        return tuple(p.stat().st_mtime_ns if p.exists() else None for p in self.files)
+
+    def refresh(self, force: bool = False) -> bool:
+        stamp = self._mtimes()
+        if not force and stamp == self._stamp: return False
+        menus = build_menus(load_config(), load_public_channels())
+        self.menus, self._stamp = menus, stamp
+        return True
+
+    def get(self, key: str):
+        return self.menus[key]
+
+RENDER = RenderCache([CONFIG_FILE, CHANNELS_FILE])
+RENDER.refresh(force=True)
+
+async def watch_render_files(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        if await asyncio.to_thread(RENDER.refresh):
+            logger.info("🔄 Menus rebuilt after config/channels change.")
+    except (OSError, ValueError, KeyError) as e:
+        logger.error(f"❌ Menu reload failed, keeping previous menus: {e}")
+
+class MediaCache:
+    """رفع كل ملف ثابت مرة واحدة وإعادة استخدام file_id (محفوظ في SQLite حسب المسار وبصمة المحتوى والبوت)."""
+
+    def __init__(self):
+        self._digests = {}   # path -> (mtime_ns, size, sha256)
+        self._ids = {}       # (path, sha256, bot_id) -> file_id
+
+    def _digest(self, path: Path) -> str:
+        st = path.stat()
+        cached = self._digests.get(path)
+        if cached and cached[:2] == (st.st_mtime_ns, st.st_size): return cached[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""): h.update(chunk)
+        self._digests[path] = (st.st_mtime_ns, st.st_size, h.hexdigest())
+        return h.hexdigest()
+
+    async def _file_id(self, key):
+        if key not in self._ids:
+            self._ids[key] = await DB.fetchval("SELECT file_id FROM media_cache WHERE path=? AND sha256=? AND bot_id=?", key)
+        return self._ids[key]
+
+    async def send_photo(self, bot, chat_id, path: Path, **kwargs):
+        sha = await asyncio.to_thread(self._digest, path)
+        key = (str(path.relative_to(BASE_DIR)) if path.is_relative_to(BASE_DIR) else str(path), sha, bot.id)
+        file_id = await self._file_id(key)
+        if file_id:
+            try: return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            except BadRequest as e:
+                logger.warning(f"⚠️ Cached file_id for {key[0]} rejected ({e}), re-uploading.")
+                self._ids.pop(key, None)
+                await DB.execute("DELETE FROM media_cache WHERE path=? AND sha256=? AND bot_id=?", key)
+        with open(path, "rb") as f:
+            msg = await bot.send_photo(chat_id=chat_id, photo=f, **kwargs)
+        self._ids[key] = msg.photo[-1].file_id
+        await DB.execute("INSERT OR REPLACE INTO media_cache (path, sha256, bot_id, file_id, updated_at) VALUES (?,?,?,?,?)",
+                         (*key, self._ids[key], datetime.datetime.now().isoformat()))
+        return msg
+
+MEDIA = MediaCache()
+
+# ─────────────────────────────────────────────
+#  حذف طلبات API المكررة (طبقة حول context.bot)
+# ─────────────────────────────────────────────
+EDIT_CACHE_MAX = 50000
+_UPDATE = contextvars.ContextVar("update_state", default=None)
+
+def _saved(kind: str, n: int = 1):
+    METRICS.inc("bot_api_saved_total", n, kind=kind)
+    state = _UPDATE.get()
+    if state is not None: state["saved"] += n
+
+async def flush_answer(state: dict):
+    pending = state.get("answer") if state else None
+    if pending is None: return
+    state["answer"] = None
+    try: await pending()
+    except TelegramError as e: logger.warning(f"⚠️ answerCallbackQuery failed: {e}")
+
+class CallDedup:
+    """ذاكرة ما يملكه تيليجرام فعلاً: نسخة قائمة الأوامر لكل محادثة (محفوظة في chat_commands)
+    وبصمة آخر نص/أزرار لكل رسالة عُدّلت (في الذاكرة، LRU)."""
+
+    def __init__(self, max_messages: int = EDIT_CACHE_MAX):
+        self.max_messages = max_messages
+        self._commands = {}            # (bot_id, chat_id) -> version
+        self._rendered = OrderedDict() # (bot_id, chat_id, message_id) | inline_id -> hash
+
+    @staticmethod
+    def commands_version(commands, language_code=None) -> str:
+        items = [(c.command, c.description) if isinstance(c, BotCommand) else tuple(c) for c in commands]
+        return hashlib.sha1(json.dumps([language_code, items], ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+    async def commands_current(self, bot_id: int, chat_id: int, version: str) -> bool:
+        key = (bot_id, chat_id)
+        if key not in self._commands:
+            self._commands[key] = await DB.fetchval("SELECT version FROM chat_commands WHERE bot_id=? AND chat_id=?", key)
+        return self._commands[key] == version
+
+    async def commands_set(self, bot_id: int, chat_id: int, version: str):
+        self._commands[(bot_id, chat_id)] = version
+        await DB.execute("INSERT INTO chat_commands (bot_id, chat_id, version, updated_at) VALUES (?,?,?,?) "
+                         "ON CONFLICT(bot_id, chat_id) DO UPDATE SET version=excluded.version, updated_at=excluded.updated_at",
+                         (bot_id, chat_id, version, datetime.datetime.now().isoformat()))
+
+    @staticmethod
+    def render_hash(text, parse_mode, reply_markup) -> str:
+        markup = reply_markup.to_json() if reply_markup is not None else ""
+        return hashlib.sha1(f"{parse_mode}\0{text}\0{markup}".encode("utf-8")).hexdigest()
+
+    def unchanged(self, key, digest: str) -> bool:
+        return key is not None and self._rendered.get(key) == digest
+
+    def remember(self, key, digest: str = None):
+        if key is None: return
+        if digest is None:
+            self._rendered.pop(key, None)
+            return
+        self._rendered[key] = digest
+        self._rendered.move_to_end(key)
+        while len(self._rendered) > self.max_messages:
+            self._rendered.popitem(last=False)
+
+DEDUP = CallDedup()
+
+def _message_key(bot_id, chat_id, message_id, inline_message_id):
+    # أرقام الرسائل تتكرر بين بوتين في نفس المحادثة الخاصة
+    if inline_message_id: return inline_message_id
+    return (bot_id, int(chat_id), int(message_id)) if chat_id is not None and message_id is not None else None
+
+def _chat_scope_id(scope):
+    if isinstance(scope, dict): return scope.get("chat_id") if scope.get("type") == "chat" else None
+    return getattr(scope, "chat_id", None) if getattr(scope, "type", None) == "chat" else None
+
+class DedupBot(ExtBot):
+    """يتخطى set_my_commands المكرر لكل محادثة وتعديلات الرسائل التي لا تغيّر شيئاً،
+    ويؤجل ردّ الضغطة الفارغ ليُرسل مع أول تعديل (بالتوازي) أو يُدمج مع ردّ نصي لاحق."""
+
+    __slots__ = ()
+
+    async def set_my_commands(self, commands, scope=None, language_code=None, **kwargs):
+        chat_id = _chat_scope_id(scope)
+        if chat_id is None: return await super().set_my_commands(commands, scope, language_code, **kwargs)
+        version = DEDUP.commands_version(commands, language_code)
+        if await DEDUP.commands_current(self.id, chat_id, version):
+            _saved("set_my_commands")
+            return True
+        result = await super().set_my_commands(commands, scope, language_code, **kwargs)
+        await DEDUP.commands_set(self.id, chat_id, version)
+        return result
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, inline_message_id=None, **kwargs):
+        key = _message_key(self.id, chat_id, message_id, inline_message_id)
+        digest = DEDUP.render_hash(text, kwargs.get("parse_mode"), kwargs.get("reply_markup"))
+        state = _UPDATE.get()
+        if DEDUP.unchanged(key, digest):
+            _saved("edit_message_text")
+            return True
+        edit = super().edit_message_text(text, chat_id, message_id, inline_message_id, **kwargs)
+        try:
+            if state and state.get("answer"):
+                # الرد على الضغطة والتعديل في رحلة واحدة بدل رحلتين متتاليتين
+                results = await asyncio.gather(edit, flush_answer(state))
+                result = results[0]
+            else:
+                result = await edit
+        except BadRequest as e:
+            if "not modified" not in str(e).lower(): raise
+            _saved("edit_message_text")
+            result = True
+        DEDUP.remember(key, digest)
+        return result
+
+    async def edit_message_reply_markup(self, chat_id=None, message_id=None, inline_message_id=None, *args, **kwargs):
+        DEDUP.remember(_message_key(self.id, chat_id, message_id, inline_message_id))
+        return await super().edit_message_reply_markup(chat_id, message_id, inline_message_id, *args, **kwargs)
+
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=None, url=None, cache_time=None, **kwargs):
+        state = _UPDATE.get()
+        call = lambda: super(DedupBot, self).answer_callback_query(callback_query_id, text, show_alert, url, cache_time, **kwargs)
+        if state is None: return await call()
+        pending = state.get("answer")
+        if text is None and not show_alert and url is None:
+            if pending is None: state["answer"] = call
+            else: _saved("answer_callback_query")
+            return True
+        if pending is not None:
+            # ردّ نصي يحل محل الرد الفارغ المؤجل
+            state["answer"] = None
+            _saved("answer_callback_query")
+        return await call()
+
+async def edit_menu(query, key: str, **fmt):
+    text, kbd, parse_mode = RENDER.get(key)
+    if fmt: text = text.format(**fmt)
+    await query.edit_message_text(text, reply_markup=kbd, parse_mode=parse_mode)
+
 # ─────────────────────────────────────────────
 #  الأوامر الرئيسية
 # ─────────────────────────────────────────────
+@timed("cmd_start")
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    db_upsert_user(user)
+    await db_upsert_user(user)
     
     # تحديث أوامر القائمة
     commands = [BotCommand("start", "بدء"), BotCommand("help", "مساعدة")]
@@ -205,6 +1652,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ])
     await update.message.reply_text(f"✨ *أهـــلاً و ســهــلاً {user.first_name}!*\n\n*احـتـفـظ بالـبـوت لـديك أو انـسـخ رابـطـه واحـفـظـه لـتـصـل إلـيـنـا مـتـى شـئـت.. جـمـيـع الـقـنـوات الـخـاصـة و الـعـامـة مـوجـودة بـالـداخـل.🔥*\n\n-*تـم إلـغـاء ربـط الـبـوت بـقـنـاة*.\n\n-تـم إلــغــاء شــرط الإشـتـراك بـقـنـاة للـمـواصـلـة للـبـوت.\n\n-لـيـبـقـى الـبـوت بـأمـان.\n\n-تــم تـحـضـيـر 10 بـوتـات احـتـيـاطـيـة بـديـلـة ✅", reply_markup=kbd, parse_mode=ParseMode.MARKDOWN)
 
+@timed("cmd_help")
 async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     if user.id in ADMIN_IDS:
@@ -215,47 +1663,21 @@ async def cmd_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    kbd = InlineKeyboardMarkup([
-        [InlineKeyboardButton(BTNS.get("btn_subscriptions", "💎 قـنـواتـنـا الـخـاصـة و العامّة"), callback_data="sub_menu")],
-        [InlineKeyboardButton(BTNS.get("btn_support", "📞 الـتـواصـل الـمـبـاشر مـع الـدعـم"), callback_data="support")],
-        [InlineKeyboardButton(BTNS.get("btn_end", "❌ إنــهــاء"), callback_data="end")]
-    ])
-    text = f"*مــرحــبــاً {user.first_name}* ✨\n\n\n*يـــرجـــى اخـــتـــيــار:*\n\n1️⃣ للإشتراك في *👑الــقــنــوات الــخــاصــة👑* أو الدخول المجاني للقنوات العامة.\n\n2️⃣ للتواصل المباشر معنا عبر الواتساب.\n\n❤️❤️❤️❤️"
-    if update.callback_query: await update.callback_query.edit_message_text(text, reply_markup=kbd, parse_mode=ParseMode.MARKDOWN)
-    else: await update.message.reply_text(text, reply_markup=kbd, parse_mode=ParseMode.MARKDOWN)
+    text, kbd, parse_mode = RENDER.get("main_menu")
+    text = text.format(first_name=user.first_name)
+    if update.callback_query: await update.callback_query.edit_message_text(text, reply_markup=kbd, parse_mode=parse_mode)
+    else: await update.message.reply_text(text, reply_markup=kbd, parse_mode=parse_mode)
 
 async def show_sub_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    kbd = InlineKeyboardMarkup([
-        [InlineKeyboardButton(SUBS.get("VIP", {}).get("label", "👑 اشـتـراك VIP الـمـمـيـز 👑"), callback_data="pay_VIP")],
-        [InlineKeyboardButton("📺 قـنـواتـنـا الـعـامـة 📺 ", callback_data="public_channels")],
-        [InlineKeyboardButton(BTNS.get("btn_back", "🔙 رجـــــوع 🔙 "), callback_data="main_menu")]
-    ])
-    await update.callback_query.edit_message_text("💯🔥 *اخــتــر الاشــتــراك الــمــطــلــوب* 🔥💯\n\n\n*-👑اشـتـراك VIP الـمـمـيـز👑*:\nيمنحك الوصول لكافة القنوات الخاصة والمحتوى الخاص بالكامل (التفاصيل بالداخل).\n\n-القنوات العامة:\n متاحة للجميع مجاناً , والقائمة متغيّرة باستمرار نتيجة حظر.\n\n ❤️❤️❤️❤️", reply_markup=kbd, parse_mode=ParseMode.MARKDOWN)
+    await edit_menu(update.callback_query, "sub_menu")
 
 async def show_pay_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, sub_key: str):
-    label = SUBS.get(sub_key, {}).get("label", sub_key)
-    price_usd = SUBS.get(sub_key, {}).get("price_usd", 25)
-    price_syp = SUBS.get(sub_key, {}).get("price_syp", price_usd * 14000)
-    
-    kbd = InlineKeyboardMarkup([
-        [InlineKeyboardButton(BTNS.get("btn_sham", "💳 شـام كاش"), callback_data="meth_sham"),
-         InlineKeyboardButton(BTNS.get("btn_syriatel", "📱 سـيـريـتـل كـاش"), callback_data="meth_syria")],
-        [InlineKeyboardButton(BTNS.get("btn_usdt", "🪙 عـمـلات رقـمـيـة USDT"), callback_data="meth_usdt")],
-        [InlineKeyboardButton("📝 تــفــاصــيــل الاشــتــراك 📝 ", callback_data="sub_details")],
-        [InlineKeyboardButton(BTNS.get("btn_back", "🔙 رجــوع"), callback_data="sub_menu")]
-    ])
-    
-    text = (
-        f"💎 *الـفـئـة:* {label}\n"
-        f"\n💰 الـتـكـلـفـة: {price_usd}$"
-        "*\nاخـتـر وسـيـلـة الـدفـع👇👇*\n\n"
-        "(إن لم تجد طريقة الدفع المتاحة لديك، تواصل معنا، نؤمن الاستلام من جميع انحاء العالم وبكل الطرق 👌🔥)"
-    )
-    await update.callback_query.edit_message_text(text, reply_markup=kbd, parse_mode=ParseMode.MARKDOWN)
+    await edit_menu(update.callback_query, f"pay_{sub_key}")
 
 # ─────────────────────────────────────────────
 #  معالج الضغطات
 # ─────────────────────────────────────────────
+@timed("handle_callback", route=callback_route)
 async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -268,50 +1690,21 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data["sub_type"] = "VIP"
         await show_pay_menu(update, context, "VIP")
     
-    elif data == "sub_details":
-        details = SUBS.get("VIP", {}).get("details", "اشتراك VIP يمنحك الوصول لكافة القنوات الخاصة بشكل دائم.")
-        await query.edit_message_text(details, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجــوع", callback_data="pay_VIP")]]), parse_mode=ParseMode.MARKDOWN)
+    elif data == "sub_details": await edit_menu(query, "sub_details")
 
     elif data.startswith("meth_"):
         method = data.replace("meth_", "")
+        if data not in RENDER.menus: return
         context.user_data["pay_method"] = method
         context.user_data["waiting_code"] = True
         
-        back_kbd = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data="pay_VIP")]])
-        if method == "sham":
-            text = f"💳 *شــام كــاش*\n\nقـم بـتـحـويـل 25$ أو 3500 ل.س جـديـدة إلى:\n\n`{WALLETS.get('sham_cash')}`\n\nأســم الــحــســاب: {WALLETS.get('sham_account_name')}\n\n\n*ثـم أرسـل رقـم الـعـمـلـيـة هـنـا 👇*"
-            if (BASE_DIR / "sham.jpg").exists():
-                await query.message.reply_photo(photo=open(BASE_DIR / "sham.jpg", "rb"), caption=text, parse_mode=ParseMode.MARKDOWN)
-                await query.message.reply_text("استخدم الزر للعودة 👇", reply_markup=back_kbd)
-            else: await query.edit_message_text(text, reply_markup=back_kbd, parse_mode=ParseMode.MARKDOWN)
-        elif method == "syria":
-            await query.edit_message_text(f"📱 *ســيــريــتــل كــاش*\n\nقـم بـتـحـويـل 3500 ل.س جـديـدة إلى:\n\n`{WALLETS.get('syriatel_cash')}`\n\n*ثـم أرسـل رقـم الـعـمـلـيـة هـنـا 👇*", reply_markup=back_kbd, parse_mode=ParseMode.MARKDOWN)
-        elif method == "usdt":
-            await query.edit_message_text(f"🪙 *USDT*\n\nقــم بــتــحــويــل 25$ إلــى أحـد الـمـحـافـظ الـتـالـيـة:\n\nBEP20:\n `{WALLETS.get('usdt_bep20')}`\n\nTRC20:\n `{WALLETS.get('usdt_trc20')}`\n\nيمكنك التواصل مع الدعم للتحويل المباشر (خارج السلسلة) إلى بينانس أو كوين اكس أو تراست والت أو سي والت .\nبالإضافة إلى شبكات: Erc20 ETH - TON .\n\n*ثـم أرسـل TxID هـنـا 👇*", reply_markup=back_kbd, parse_mode=ParseMode.MARKDOWN)
-
-    elif data == "public_channels":
-        channels = load_public_channels()
-        if not channels: 
-            await query.edit_message_text("لا توجد قنوات حالياً.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data="sub_menu")]]))
-        else:
-            # عرض القنوات كمربعات (3 في كل صف)
-            kbd = []
-            row = []
-            for ch in channels:
-                row.append(InlineKeyboardButton(ch["name"], url=ch["url"]))
-                if len(row) == 3:
-                    kbd.append(row)
-                    row = []
-            if row: kbd.append(row)
-            
-            kbd.append([InlineKeyboardButton("🔙 رجــوع", callback_data="sub_menu")])
-            await query.edit_message_text("📺 قــنــواتــنــا الــعــامــة 🔥🔥\n\n-نقوم بتغيير هذه القائمة باستمرار. \n\n-سيكون لكل قناة محتوى خاص بها. 🔥\n\n-يمكنك الاشتراك بهم جميعاً لتبقى معنا.\n\n\nاضغط على اي قناة في الاسفل للانتقال إليها👇👇👇:", reply_markup=InlineKeyboardMarkup(kbd))
-
-    elif data == "support":
-        kbd = [[InlineKeyboardButton(f"💬 {SUPPORT.get('label1')} - واتـسـاب", url=f"https://wa.me/{SUPPORT.get('whatsapp1')}")],
-               [InlineKeyboardButton(f"💬 {SUPPORT.get('label2')} - واتـسـاب", url=f"https://wa.me/{SUPPORT.get('whatsapp2')}")],
-               [InlineKeyboardButton("🔙 رجــوع", callback_data="main_menu")]]
-        await query.edit_message_text("📞 تـواصـل مـعـنـا مـبـاشـرة عبر الواتساب:", reply_markup=InlineKeyboardMarkup(kbd))
+        if method == "sham" and (BASE_DIR / "sham.jpg").exists():
+            text, back_kbd, parse_mode = RENDER.get(data)
+            await MEDIA.send_photo(context.bot, query.message.chat_id, BASE_DIR / "sham.jpg", caption=text, parse_mode=parse_mode)
+            await query.message.reply_text("استخدم الزر للعودة 👇", reply_markup=back_kbd)
+        else: await edit_menu(query, data)
+
+    elif data in ("public_channels", "support"): await edit_menu(query, data)
     
     elif data == "end": await query.edit_message_text("👋 تم إغلاق الجلسة. شكراً لاستخدامك البوت!")
     elif data.startswith("adm_"): await handle_admin_callback(update, context)
@@ -319,15 +1712,15 @@ async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ─────────────────────────────────────────────
 #  معالج الرسائل النصية
 # ─────────────────────────────────────────────
+@timed("handle_text")
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     text = update.message.text
     
     # تسجيل الرسائل من غير الأدمن
     if user.id not in ADMIN_IDS:
-        db_log_message(user.id, user.username, user.first_name, text)
-        for aid in ADMIN_IDS: 
-            await safe_send(context.bot, aid, text=f"👁 *رسالة من:* {user.first_name} ({user.id})\n💬 {text}")
+        await db_log_message(user.id, user.username, user.first_name, text)
+        NOTIFIER.notify(user, text)
 
     # معالجة انتظار كود الدفع
     if context.user_data.get("waiting_code"):
@@ -335,13 +1728,7 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         sub_type = context.user_data.get("sub_type", "VIP")
         pay_method = context.user_data.get("pay_method", "unknown")
         
-        conn = get_db()
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO payments (user_id, sub_type, pay_method, pay_code, created_at) VALUES (?,?,?,?,?)", 
-                       (user.id, sub_type, pay_method, text, datetime.datetime.now().isoformat()))
-        pay_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        pay_id, dup = await db_add_payment(user.id, sub_type, pay_method, text)
         
         await update.message.reply_text("✅ تم استلام الكود بنجاح! سيتم مراجعته من قبل الإدارة وتفعيل اشتراكك قريباً.")
         
@@ -349,32 +1736,43 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("✅ قبول", callback_data=f"adm_ok_{user.id}_{pay_id}"), 
              InlineKeyboardButton("❌ رفض", callback_data=f"adm_no_{user.id}_{pay_id}")]
         ])
-        for aid in ADMIN_IDS: 
-            await safe_send(context.bot, aid, 
-                            text=f"🔔 *طلب دفع جديد!*\n👤 {user.first_name}\n🆔 `{user.id}`\n💎 {sub_type}\n💳 {pay_method}\n🔑 `{text}`", 
-                            reply_markup=kbd)
+        warn = f"\n\n⚠️ *كود مكرر!* استُخدم في الطلب #{dup['id']} (المستخدم `{dup['user_id']}`، الحالة: {dup['status']})" if dup else ""
+        NOTIFIER.urgent(text=f"🔔 *طلب دفع جديد!*\n👤 {user.first_name}\n🆔 `{user.id}`\n💎 {sub_type}\n💳 {pay_method}\n🔑 `{text.strip()}`{warn}",
+                        reply_markup=kbd)
         return
 
     # أوامر الأدمن النصية
     if user.id in ADMIN_IDS:
         if text.startswith("بث "):
             msg = text.replace("بث ", "").strip()
-            conn = get_db()
-            users = [r['user_id'] for r in conn.execute("SELECT user_id FROM users").fetchall()]
-            conn.close()
-            
-            sent, blocked = 0, 0
-            status_msg = await update.message.reply_text(f"⏳ جاري الإرسال لـ {len(users)} مستخدم...")
-            
-            for uid in users:
-                try:
-                    await context.bot.send_message(chat_id=uid, text=f"💬 *رســالــة مــن الإدارة 📩:*\n\n{msg}", parse_mode=ParseMode.MARKDOWN)
-                    sent += 1
-                    await asyncio.sleep(0.05)
-                except TelegramError as e:
-                    if "bot was blocked" in str(e): blocked += 1
-            
-            await status_msg.edit_text(f"✅ تم الإرسال لـ {sent} مستخدم\n🚫 {blocked} مستخدمين حظروا البوت")
+            total = await DB.fetchval("SELECT COUNT(*) FROM users WHERE is_blocked=0")
+            status_msg = await update.message.reply_text(f"⏳ جاري الإرسال لـ {total} مستخدم...")
+            bid = await db_create_broadcast(user.id, status_msg.chat_id, status_msg.message_id, msg, total)
+            context.application.create_task(run_broadcast(context.bot, bid), update=update)
+
+        elif text.startswith("بحث "):
+            # بحث <كلمات>  |  بحث <user_id> [كلمات]
+            parts = text.split(maxsplit=2)
+            if len(parts) < 2: return
+            target_id = int(parts[1]) if parts[1].lstrip("-").isdigit() else None
+            words = (parts[2] if len(parts) == 3 else "") if target_id is not None else text.split(maxsplit=1)[1]
+            try:
+                results = await db_search_messages(words, target_id)
+            except sqlite3.OperationalError:
+                results = []
+            if not results:
+                await update.message.reply_text("🔍 لا توجد نتائج.")
+                return
+            lines = [f"🔍 {len(results)} نتيجة (الأحدث أولاً):"]
+            for m in results:
+                lines.append(f"\n🕒 {(m['created_at'] or '')[:16].replace('T', ' ')} · 👤 {m['first_name']} ({m['user_id']})\n{(m['message'] or '')[:300]}")
+            chunk = ""
+            for line in lines:
+                if len(chunk) + len(line) + 1 > TG_MAX_TEXT:
+                    await update.message.reply_text(chunk)
+                    chunk = ""
+                chunk += line + "\n"
+            await update.message.reply_text(chunk)
 
         elif text.startswith("رد "):
             parts = text.split(maxsplit=2)
@@ -389,13 +1787,15 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ─────────────────────────────────────────────
 #  لوحة الأدمن الشاملة
 # ─────────────────────────────────────────────
+@timed("cmd_admin")
 @admin_only
 async def cmd_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    stats = db_get_stats()
+    stats = await db_get_stats()
     kbd = [
         [InlineKeyboardButton("📊 الإحصائيات التفصيلية", callback_data="adm_stats"), 
          InlineKeyboardButton("💾 نسخة احتياطية فورية", callback_data="adm_backup")],
-        [InlineKeyboardButton("📋 طلبات الدفع المعلقة", callback_data="adm_pending")],
+        [InlineKeyboardButton("📋 طلبات الدفع المعلقة", callback_data="adm_pending"),
+         InlineKeyboardButton("📈 مقاييس الأداء", callback_data="adm_metrics")],
         [InlineKeyboardButton("🚫 حظر مستخدم", callback_data="adm_ban_menu"),
          InlineKeyboardButton("🔓 فك حظر", callback_data="adm_unban_menu")],
         [InlineKeyboardButton("❌ إغلاق", callback_data="end")]
@@ -409,72 +1809,199 @@ async def cmd_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(kbd), parse_mode=ParseMode.MARKDOWN)
 
+def render_metrics_view(top: int = 12) -> str:
+    ms = lambda v: f"{v * 1000:.0f}" if v != float("inf") else "∞"
+    lines = ["📈 مقاييس الأداء (p50/p95 ms · عدد)", "", "⏱ المعالجات:"]
+    handlers = sorted(((k, h) for k, h in METRICS.histograms.items() if k[0] == "bot_handler_seconds"), key=lambda kv: -kv[1].n)
+    for (_, labels), h in handlers[:top]:
+        lb = dict(labels)
+        db = METRICS.histograms.get(("bot_handler_db_seconds", labels))
+        api = METRICS.histograms.get(("bot_handler_api_seconds", labels))
+        name = lb["handler"] + (f":{lb['route']}" if lb["route"] else "")
+        lines.append(f"• {name}  {ms(h.quantile(.5))}/{ms(h.quantile(.95))} · {h.n}  (db {ms(db.sum / db.n) if db and db.n else 0} | api {ms(api.sum / api.n) if api and api.n else 0} avg)")
+    lines += ["", "🌐 Telegram API:"]
+    api_calls = sorted(((dict(k[1])["method"], h) for k, h in METRICS.histograms.items() if k[0] == "bot_api_seconds"), key=lambda kv: -kv[1].n)
+    for method, h in api_calls[:top]:
+        lines.append(f"• {method}  {ms(h.quantile(.5))}/{ms(h.quantile(.95))} · {h.n}")
+    lines += ["", "🗄 قاعدة البيانات:"]
+    for op in ("read", "write"):
+        h = METRICS.histograms.get(("bot_db_seconds", (("op", op),)))
+        if h: lines.append(f"• {op}  {ms(h.quantile(.5))}/{ms(h.quantile(.95))} · {h.n}")
+    saved = {dict(k[1])["kind"]: v for k, v in METRICS.counters.items() if k[0] == "bot_api_saved_total"}
+    updates = sum(v for k, v in METRICS.counters.items() if k[0] == "bot_updates_total")
+    if saved:
+        lines += ["", f"✂️ طلبات موفّرة ({sum(saved.values()) / max(updates, 1):.2f} لكل تحديث):"]
+        lines += [f"• {kind}: {n}" for kind, n in sorted(saved.items(), key=lambda kv: -kv[1])]
+    lines += ["", "📥 الطوابير:"]
+    for name, fn in sorted(METRICS.gauges.items()):
+        try: lines.append(f"• {name}: {fn()}")
+        except Exception: pass
+    return "\n".join(lines)
+
+@timed("handle_admin_callback", route=callback_route)
 async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
     
     if data == "adm_main":
-        stats = db_get_stats()
+        stats = await db_get_stats()
         kbd = [
             [InlineKeyboardButton("📊 الإحصائيات التفصيلية", callback_data="adm_stats"), 
              InlineKeyboardButton("💾 نسخة احتياطية فورية", callback_data="adm_backup")],
-            [InlineKeyboardButton("📋 طلبات الدفع المعلقة", callback_data="adm_pending")],
+            [InlineKeyboardButton("📋 طلبات الدفع المعلقة", callback_data="adm_pending"),
+             InlineKeyboardButton("📈 مقاييس الأداء", callback_data="adm_metrics")],
             [InlineKeyboardButton("❌ إغلاق", callback_data="end")]
         ]
         await query.edit_message_text(f"🛡 لوحة التحكم:\n\nالمستخدمين: {stats['total']}\nنشطون: {stats['active']}", reply_markup=InlineKeyboardMarkup(kbd))
 
     elif data == "adm_stats":
-        stats = db_get_stats()
+        stats = await db_get_stats()
         text = f"📊 *إحصائيات البوت:*\n\n- إجمالي المستخدمين: {stats['total']}\n- المشتركون VIP: {stats['active']}\n- طلبات معلقة: {stats['pending']}"
+        text += f"\n- ذاكرة الاشتراك: {MEMBERS.hit_rate:.0%} إصابة ({MEMBERS.hits}/{MEMBERS.hits + MEMBERS.misses})"
+        arch = await asyncio.to_thread(archive.stats, ARCHIVE_DIR)
+        text += f"\n- أرشيف الرسائل: {arch['rows']} رسالة في {arch['segments']} يوم ({arch['bytes'] // 1024} KB)"
+        for label, metric in (("👤 مستخدمون جدد", "new_users"), ("💬 رسائل", "messages"), ("💳 طلبات دفع", "payments")):
+            hourly = await db_get_series(metric, "h", 24)
+            daily = await db_get_series(metric, "d", 7)
+            text += f"\n\n{label}:\n  24 ساعة: {sum(hourly)}  `{sparkline(hourly)}`\n  7 أيام: {sum(daily)}  `{sparkline(daily)}`"
         await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data="adm_main")]]), parse_mode=ParseMode.MARKDOWN)
 
+    elif data == "adm_metrics":
+        await query.edit_message_text(render_metrics_view()[:TG_MAX_TEXT], reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔄 تحديث", callback_data="adm_metrics"), InlineKeyboardButton("🔙 رجوع", callback_data="adm_main")]]))
+
     elif data == "adm_backup":
         await backup_database(context)
         await query.answer("✅ تم إرسال النسخة الاحتياطية لقناة الأرشيف!")
 
-    elif data == "adm_pending":
-        conn = get_db()
-        pending = conn.execute("SELECT p.*, u.first_name FROM payments p JOIN users u ON p.user_id = u.user_id WHERE p.status='pending' LIMIT 10").fetchall()
-        conn.close()
-        if not pending:
+    elif data == "adm_pending" or data.startswith("adm_pg_"):
+        # adm_pg_n_<آخر معرف في الصفحة> / adm_pg_p_<أول معرف> / adm_pg_a_<أول معرف> (إعادة عرض نفس الصفحة)
+        parts = data.split("_")
+        cursor = int(parts[3]) if len(parts) == 4 else None
+        rows, has_prev, has_next = await db_pending_page(cursor, parts[2] if cursor else "n")
+        if not rows and data == "adm_pending":
             await query.answer("لا توجد طلبات معلقة حالياً.")
             return
-        
-        text = "📋 *آخر الطلبات المعلقة:*\n\n"
-        for p in pending:
-            text += f"👤 {p['first_name']} | 💎 {p['sub_type']} | 🔑 `{p['pay_code']}`\n"
-        
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 رجوع", callback_data="adm_main")]]), parse_mode=ParseMode.MARKDOWN)
+        text, markup = render_pending_page(rows, has_prev, has_next, (await db_get_stats())["pending"])
+        await query.edit_message_text(text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
+
+    elif data.startswith(("adm_bulk_ok_", "adm_bulk_no_")):
+        _, _, action, first, last = data.split("_")
+        kbd = InlineKeyboardMarkup([[InlineKeyboardButton("⚠️ تأكيد", callback_data=f"adm_bulkc_{action}_{first}_{last}"),
+                                     InlineKeyboardButton("🔙 إلغاء", callback_data=f"adm_pg_a_{first}")]])
+        await query.edit_message_reply_markup(reply_markup=kbd)
+
+    elif data.startswith("adm_bulkc_"):
+        _, _, action, first, last = data.split("_")
+        approve = action == "ok"
+        reviewed = await db_review_range(int(first), int(last), approve)
+        msg = ("✅ *تهانينا!* تم تفعيل اشتراك VIP الخاص بك بنجاح. يمكنك الآن الاستمتاع بكافة الميزات." if approve
+               else "❌ نعتذر، تم رفض طلب الدفع الخاص بك. يرجى التأكد من البيانات أو التواصل مع الدعم.")
+        context.application.create_task(notify_reviewed(context.bot, {uid for uid, _ in reviewed}, text=msg,
+                                                        parse_mode=ParseMode.MARKDOWN if approve else None), update=update)
+        if approve: schedule_expiry()
+        rows, has_prev, has_next = await db_pending_page(int(last))
+        text, markup = render_pending_page(rows, has_prev, has_next, (await db_get_stats())["pending"])
+        done = f"{'🟢 تم قبول' if approve else '🔴 تم رفض'} {len(reviewed)} طلب.\n\n"
+        await query.edit_message_text(done + text, reply_markup=markup, parse_mode=ParseMode.MARKDOWN)
 
     elif data.startswith("adm_ok_"):
         _, _, uid, pid = data.split("_")
-        conn = get_db()
-        conn.execute("UPDATE users SET sub_status='active', sub_type='VIP' WHERE user_id=?", (uid,))
-        conn.execute("UPDATE payments SET status='approved' WHERE id=?", (pid,))
-        conn.commit()
-        conn.close()
+        await DB.transaction(lambda conn: activate_subscription(conn, int(uid), int(pid)))
+        schedule_expiry()
         await safe_send(context.bot, int(uid), text="✅ *تهانينا!* تم تفعيل اشتراك VIP الخاص بك بنجاح. يمكنك الآن الاستمتاع بكافة الميزات.", parse_mode=ParseMode.MARKDOWN)
         await query.edit_message_text(query.message.text + "\n\n🟢 تم القبول والتفعيل ✅")
 
     elif data.startswith("adm_no_"):
         _, _, uid, pid = data.split("_")
-        conn = get_db()
-        conn.execute("UPDATE payments SET status='rejected' WHERE id=?", (pid,))
-        conn.commit()
-        conn.close()
+        await DB.execute("UPDATE payments SET status='rejected' WHERE id=?", (pid,))
         await safe_send(context.bot, int(uid), text="❌ نعتذر، تم رفض طلب الدفع الخاص بك. يرجى التأكد من البيانات أو التواصل مع الدعم.")
         await query.edit_message_text(query.message.text + "\n\n🔴 تم الرفض ❌")
 
 # ─────────────────────────────────────────────
 #  تشغيل البوت
 # ─────────────────────────────────────────────
-def main():
-    init_db()
-    if not TOKEN:
-        print("❌ خطأ: لم يتم العثور على TOKEN في ملف الإعدادات!")
-        return
-        
-    app = Application.builder().token(TOKEN).build()
+async def on_startup(app: Application):
+    WB.start()
+    NOTIFIER.start(app.bot)
+    METRICS.gauge("bot_update_queue", lambda: app.update_queue.qsize())
+    METRICS.gauge("bot_updates_in_flight", lambda: app.update_processor.current_concurrent_updates)
+    METRICS.gauge("bot_write_behind_pending", lambda: len(WB))
+    METRICS.gauge("bot_admin_notify_depth", lambda: NOTIFIER.depth)
+    METRICS.gauge("bot_member_cache_size", lambda: len(MEMBERS._data))
+    METRICS.gauge("bot_member_cache_hit_rate", lambda: round(MEMBERS.hit_rate, 4))
+    app.bot_data["metrics_server"] = await start_metrics_server()
+
+async def on_stop(app: Application):
+    # قبل إغلاق اتصال البوت: تفريغ ما تبقى من إشعارات الأدمن
+    await NOTIFIER.stop()
+
+async def on_shutdown(app: Application):
+    server = app.bot_data.pop("metrics_server", None)
+    if server: server.close()
+    await WB.stop()
+    DB.close()
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """معالجة متوازية للتحديثات مع الحفاظ على ترتيبها لكل مستخدم (حتى لا يتسابق waiting_code في user_data)."""
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}   # key -> [Lock, عدد المنتظرين]
+
+    @staticmethod
+    def _key(update):
+        if not isinstance(update, Update): return None
+        if update.effective_user: return update.effective_user.id
+        if update.effective_chat: return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        if key is None:
+            await coroutine
+            return
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]: del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+JOB_QUEUE = None   # طابور المهام الدورية: واحد في العملية (البوت الأساسي)
+
+def schedule_jobs(app: Application):
+    global JOB_QUEUE
+    if not app.job_queue: return
+    JOB_QUEUE = app.job_queue
+    # جدولة النسخ الاحتياطي (كل 6 ساعات = 21600 ثانية)
+    app.job_queue.run_repeating(backup_database, interval=21600, first=10)
+    app.job_queue.run_once(resume_broadcasts, when=1)
+    app.job_queue.run_repeating(watch_render_files, interval=RELOAD_INTERVAL, first=RELOAD_INTERVAL)
+    app.job_queue.run_repeating(archive_old_messages, interval=86400, first=60)
+    app.job_queue.run_once(expiry_job, when=5, name=EXPIRY_JOB)
+
+def build_application(token: str = TOKEN, base_url: str = BOT_API_URL, processor: BaseUpdateProcessor = None,
+                      standalone: bool = True) -> Application:
+    # standalone=False: ضمن BotFleet التي تدير دورة الحياة والمهام المشتركة بنفسها
+    bot = DedupBot(token, base_url=base_url or "https://api.telegram.org/bot",
+                   base_file_url=base_url.replace("/bot", "/file/bot") if base_url else "https://api.telegram.org/file/bot",
+                   request=InstrumentedRequest(connection_pool_size=256),
+                   get_updates_request=InstrumentedRequest(connection_pool_size=1))
+    builder = (Application.builder().bot(bot)
+               .concurrent_updates(processor or PerUserUpdateProcessor(CONCURRENCY))
+               .persistence(SQLitePersistence(DB)))
+    if standalone:
+        builder = builder.post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown)
+    app = builder.build()
     
     # المعالجات
     app.add_handler(CommandHandler("start", cmd_start))
@@ -482,13 +2009,186 @@ def main():
     app.add_handler(CommandHandler("help", cmd_help))
     app.add_handler(CallbackQueryHandler(handle_callback))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    app.add_handler(ChatMemberHandler(handle_chat_member, ChatMemberHandler.CHAT_MEMBER))
     
-    # جدولة النسخ الاحتياطي (كل 6 ساعات = 21600 ثانية)
-    if app.job_queue:
-        app.job_queue.run_repeating(backup_database, interval=21600, first=10)
+    if standalone: schedule_jobs(app)
+    return app
+
+def webhook_kwargs(webhook: dict = WEBHOOK) -> dict:
+    path = webhook.get("PATH", "telegram")
+    return {
+        "listen": webhook.get("LISTEN", "0.0.0.0"),
+        "port": int(os.environ.get("PORT", webhook.get("PORT", 8443))),
+        "url_path": path,
+        "webhook_url": f"{webhook['URL'].rstrip('/')}/{path}",
+        "secret_token": webhook.get("SECRET") or None,
+    }
+
+# ─────────────────────────────────────────────
+#  عدة بوتات في عملية واحدة (أساسي + احتياطية)
+# ─────────────────────────────────────────────
+def fleet_specs() -> list:
+    specs = [{"name": "main", "token": TOKEN, "base_url": BOT_API_URL}]
+    for i, b in enumerate(BOTS, start=1):
+        specs.append({"name": b.get("NAME", f"bot{i}"), "token": b["TOKEN"], "base_url": b.get("BOT_API_URL", BOT_API_URL)})
+    return specs
+
+class BotFleet:
+    """كل البوتات تستقبل التحديثات معاً وتتشارك كاتب قاعدة البيانات والذاكرات وطابور إشعارات الأدمن.
+    الأساسي وحده يشغّل المهام الدورية ويرسل إشعارات الأدمن؛ إن حُظر (توكن ملغى/403) يُرقّى أول احتياطي سليم."""
+
+    def __init__(self, specs: list, mode: str = "polling", webhook: dict = None, check_interval: float = None):
+        self.names = [s["name"] for s in specs]
+        self.apps = [build_application(s["token"], s.get("base_url", BOT_API_URL), standalone=False) for s in specs]
+        self.mode = mode
+        self.webhook = webhook or {}
+        self.check_interval = check_interval or FAILOVER_CHECK
+        self.alive = set()
+        self.primary = None
+        self.failovers = []       # (الاسم القديم، الجديد، الزمن)
+        self._kick = asyncio.Event()
+        self._watcher = None
+        self._server = None
+        self._host = None
+
+    @property
+    def primary_app(self) -> Application:
+        return self.apps[self.primary] if self.primary is not None else None
+
+    async def start(self):
+        for i, app in enumerate(self.apps):
+            try:
+                await app.initialize()
+                self.alive.add(i)
+            except (InvalidToken, Forbidden) as e:
+                logger.error(f"❌ Bot {self.names[i]} unusable at startup: {e}")
+        if not self.alive: raise RuntimeError("لا يوجد أي بوت صالح للتشغيل")
+        self.primary = min(self.alive)
+        self._host = self.primary_app     # يحمل موارد العملية (خادم المقاييس) حتى الإغلاق
+        await on_startup(self._host)
+        METRICS.gauge("bot_update_queue", lambda: sum(self.apps[i].update_queue.qsize() for i in self.alive))
+        METRICS.gauge("bot_updates_in_flight", lambda: sum(self.apps[i].update_processor.current_concurrent_updates for i in self.alive))
+        METRICS.gauge("bot_fleet_alive", lambda: len(self.alive))
+
+        if self.mode == "webhook": await self._start_webhook()
+        for i in sorted(self.alive):
+            app = self.apps[i]
+            app.add_error_handler(self._on_handler_error)
+            if self.mode != "webhook":
+                await app.updater.start_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES,
+                                                error_callback=self._on_poll_error)
+            await app.start()
+        schedule_jobs(self.primary_app)
+        self._watcher = asyncio.create_task(self._watch())
+        logger.info(f"🚀 Fleet up: {', '.join(self.names[i] for i in sorted(self.alive))} (primary: {self.names[self.primary]})")
+
+    async def _start_webhook(self):
+        # خادم واحد لكل البوتات: /<PATH>/<اسم البوت>
+        import tornado.web, tornado.httpserver
+        from telegram.ext._utils.webhookhandler import TelegramHandler
+        kw = webhook_kwargs(self.webhook)
+        handlers = []
+        for i in sorted(self.alive):
+            app, name = self.apps[i], self.names[i]
+            handlers.append((rf"/{kw['url_path']}/{name}/?", TelegramHandler,
+                             {"bot": app.bot, "update_queue": app.update_queue, "secret_token": kw["secret_token"]}))
+            await app.bot.set_webhook(url=f"{kw['webhook_url']}/{name}", secret_token=kw["secret_token"],
+                                      allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        self._server = tornado.httpserver.HTTPServer(tornado.web.Application(handlers))
+        self._server.listen(kw["port"], kw["listen"])
+
+    async def _on_handler_error(self, update, context: ContextTypes.DEFAULT_TYPE):
+        # توكن ملغى يظهر أولاً في رد الإرسال؛ لا ننتظر الفحص الدوري
+        if isinstance(context.error, InvalidToken): self._kick.set()
+
+    def _on_poll_error(self, error: TelegramError):
+        if isinstance(error, (Forbidden, InvalidToken)): self._kick.set()
+        else: logger.warning(f"⚠️ Polling error: {error}")
+
+    async def _probe(self, i: int) -> bool:
+        try: await self.apps[i].bot.get_me()
+        except (InvalidToken, Forbidden): return False
+        except TelegramError: pass   # مشكلة شبكة/مهلة تصيب الجميع؛ ليست حظراً
+        return True
+
+    async def _watch(self):
+        while True:
+            try: await asyncio.wait_for(self._kick.wait(), self.check_interval)
+            except asyncio.TimeoutError: pass
+            self._kick.clear()
+            live = sorted(self.alive)
+            results = await asyncio.gather(*(self._probe(i) for i in live))
+            for i, ok in zip(live, results):
+                if not ok: await self._retire(i)
+
+    async def _retire(self, i: int):
+        self.alive.discard(i)
+        app = self.apps[i]
+        logger.error(f"🚫 Bot {self.names[i]} is blocked or its token was revoked")
+        if app.updater and app.updater.running:
+            try: await app.updater.stop()
+            except TelegramError: pass   # حلقة الاستقبال انتهت أصلاً بخطأ التوكن
+        if app.running: await app.stop()
+        if i == self.primary: await self._promote(i)
+
+    async def _promote(self, old: int):
+        if not self.alive:
+            self.primary = None
+            logger.error("❌ No standby bot left")
+            return
+        self.primary = min(self.alive)
+        app = self.primary_app
+        schedule_jobs(app)               # المهام الدورية + استئناف البث المتوقف
+        NOTIFIER.start(app.bot)          # إشعارات الأدمن عبر البوت الجديد
+        self.failovers.append((self.names[old], self.names[self.primary], time.time()))
+        logger.info(f"🔀 Failover: {self.names[old]} → {self.names[self.primary]} (@{app.bot.username})")
+        NOTIFIER.urgent(text=f"🔀 البوت {self.names[old]} لم يعد متاحاً (محظور أو توكن ملغى).\n"
+                             f"✅ تم التحويل تلقائياً إلى {self.names[self.primary]} @{app.bot.username}")
+
+    async def stop(self):
+        if self._watcher:
+            self._watcher.cancel()
+            try: await self._watcher
+            except asyncio.CancelledError: pass
+        if self._server: self._server.stop()
+        for i in sorted(self.alive):
+            app = self.apps[i]
+            if app.updater and app.updater.running: await app.updater.stop()
+            if app.running: await app.stop()
+        await on_stop(self._host)
+        for app in self.apps:
+            try: await app.shutdown()
+            except Exception: pass
+        await on_shutdown(self._host)
+
+    async def serve(self):
+        await self.start()
+        done = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, done.set)
+        try: await done.wait()
+        finally: await self.stop()
+
+def main():
+    init_db()
+    if not TOKEN:
+        print("❌ خطأ: لم يتم العثور على TOKEN في ملف الإعدادات!")
+        return
+        
+    if BOTS:
+        logger.info(f"🚀 البوت v5.0 يعمل الآن مع {len(BOTS)} بوت احتياطي (الوضع: {MODE})")
+        fleet = BotFleet(fleet_specs(), mode="webhook" if MODE == "webhook" and WEBHOOK.get("URL") else "polling", webhook=WEBHOOK)
+        asyncio.run(fleet.serve())
+        return
+
+    app = build_application()
     
-    logger.info("🚀 البوت v5.0 يعمل الآن بكافة التعديلات المطلوبة!")
-    app.run_polling(drop_pending_updates=True)
+    logger.info(f"🚀 البوت v5.0 يعمل الآن بكافة التعديلات المطلوبة! (الوضع: {MODE})")
+    if MODE == "webhook" and WEBHOOK.get("URL"):
+        app.run_webhook(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES, **webhook_kwargs())
+    else:
+        app.run_polling(drop_pending_updates=True, allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()